@@ -0,0 +1,196 @@
+"""
+
+Incremental reads of the preprint table in Airtable, and batched write-back of results.
+Records are filtered server-side with a formula, only the fields the scripts use are
+downloaded, and pages are read one at a time. A checkpoint per script remembers when the
+table was last fully processed and a hash of each processed record's title, DOI and concepts,
+so a run only picks up records that are new or changed since then.
+Results are written back from a background thread, 10 records per request.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+from pyairtable.formulas import AND, OR, EQ, IS_AFTER, LAST_MODIFIED_TIME, Field
+
+import metrics
+import rate_limit
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.getenv('REFEREE_CHECKPOINT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+VIEW = 'Proposals'
+STATUSES = ('To Pitch(Editorial)', 'Selected')
+# Only these fields are downloaded
+FIELDS = ['Title', 'Link/DOI', 'Updated Concepts', 'Status']
+# Fields whose changes mean a record has to be processed again
+HASHED_FIELDS = ['Title', 'Link/DOI', 'Updated Concepts']
+# Airtable's maximum page size
+PAGE_SIZE = 100
+# Airtable updates at most 10 records per request
+WRITE_BATCH_SIZE = 10
+# How long the writer waits for more results before sending a partial batch, in seconds
+FLUSH_DELAY = 1.0
+# Look back a little past the last sync so clock skew between us and Airtable can't hide an edit,
+# records seen twice are skipped by their hash
+OVERLAP = datetime.timedelta(hours=1)
+
+
+def record_hash(record):
+    fields = record['fields']
+    values = [fields.get(name) for name in HASHED_FIELDS]
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def pending_formula(since=None):
+    """
+    Records in one of STATUSES that have concepts, edited after since if it is given.
+    """
+    conditions = [
+        OR(*(EQ(Field('Status'), status) for status in STATUSES)),
+        Field('Updated Concepts'),
+    ]
+    if since is not None:
+        conditions.append(IS_AFTER(LAST_MODIFIED_TIME(*(Field(name) for name in FIELDS)), since - OVERLAP))
+    return AND(*conditions)
+
+
+class Checkpoint:
+    def __init__(self, name, path=None):
+        self.path = path or os.path.join(CHECKPOINT_DIR, f'airtable_{name}.json')
+        self.synced_at = None
+        # record id -> hash of the record when it was last processed
+        self.hashes = {}
+        # records fetched this run, and the time the fetch started
+        self.seen = set()
+        self.started_at = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('synced_at'):
+                self.synced_at = datetime.datetime.fromisoformat(data['synced_at'])
+            self.hashes = data.get('hashes', {})
+
+    def changed(self, record):
+        return self.hashes.get(record['id']) != record_hash(record)
+
+    def mark(self, record):
+        """
+        Record that a record was processed, call it once the record is done.
+        """
+        self.hashes[record['id']] = record_hash(record)
+
+    def unmark(self, record_id):
+        """
+        Forget a processed record, so the next run processes it again.
+        """
+        self.hashes.pop(record_id, None)
+
+    def save(self):
+        """
+        Write the checkpoint. The sync time only moves forward once every record fetched this run
+        has been marked, so records left over by a partial run are fetched again next time.
+        """
+        if self.started_at is not None and all(
+            self.hashes.get(record_id) == digest for record_id, digest in self.seen
+        ):
+            self.synced_at = self.started_at
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'synced_at': self.synced_at.isoformat() if self.synced_at else None,
+                'hashes': self.hashes,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+def pending_records(table, checkpoint=None, view=VIEW, fields=FIELDS, page_size=PAGE_SIZE):
+    """
+    Yield the records that need processing, one Airtable page at a time.
+    Without a checkpoint every matching record is yielded.
+    """
+    since = None
+    if checkpoint is not None:
+        checkpoint.started_at = datetime.datetime.now(datetime.timezone.utc)
+        since = checkpoint.synced_at
+    start = time.monotonic()
+    for page in table.iterate(view=view, fields=fields, formula=pending_formula(since), page_size=page_size):
+        # pyairtable has its own session, so page reads are counted here
+        metrics.registry.record('airtable', 'iterate', 200, time.monotonic() - start)
+        for record in page:
+            if checkpoint is None:
+                yield record
+                continue
+            checkpoint.seen.add((record['id'], record_hash(record)))
+            if checkpoint.changed(record):
+                yield record
+        start = time.monotonic()
+
+
+class RecordWriter:
+    """
+    Writes one field of many records back to Airtable from a background thread,
+    so processing carries on while results are uploaded.
+    """
+    def __init__(self, table, field, batch_size=WRITE_BATCH_SIZE, limiter=rate_limit.limiter):
+        self.table = table
+        self.field = field
+        self.batch_size = batch_size
+        self.limiter = limiter
+        self.written = 0
+        # ids of the records whose update failed
+        self.failed = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, record_id, value):
+        self._queue.put({'id': record_id, 'fields': {self.field: value}})
+
+    def close(self):
+        """
+        Send whatever is still queued and wait for the writer to finish. Returns the failed record ids.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        return self.failed
+
+    def _run(self):
+        closed = False
+        while not closed:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Take whatever else comes in shortly after, up to a full batch
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=FLUSH_DELAY)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        waited = self.limiter.acquire('airtable')
+        start = time.monotonic()
+        try:
+            self.table.batch_update(batch, typecast=True)
+        except requests.RequestException as e:
+            metrics.registry.record('airtable', 'batch_update', 'error', time.monotonic() - start, rate_limit_wait=waited)
+            log.error("An error occurred while writing %d records to Airtable: %s", len(batch), e)
+            self.failed.extend(update['id'] for update in batch)
+        else:
+            metrics.registry.record('airtable', 'batch_update', 200, time.monotonic() - start, rate_limit_wait=waited)
+            self.written += len(batch)
@@ -0,0 +1,158 @@
+"""
+
+Candidate referee records shared by the OpenAlex, Semantic Scholar and PubMed lookups.
+Each author is stored once per preprint no matter how many references they wrote, keyed by
+ORCID, OpenAlex author ID or Semantic Scholar author ID (name for PubMed, which has no IDs),
+with a count of the matched references they appear on.
+"""
+
+
+# Candidates written per preprint by format_candidates
+MAX_CANDIDATES = 25
+
+
+def normalize_orcid(orcid):
+    # "https://orcid.org/0000-0002-1825-0097" -> "0000-0002-1825-0097"
+    return orcid.rstrip('/').rsplit('/', 1)[-1] if orcid else None
+
+
+def normalize_openalex_id(openalex_id):
+    # "https://openalex.org/A5023888391" -> "A5023888391"
+    return openalex_id.rstrip('/').rsplit('/', 1)[-1] if openalex_id else None
+
+
+class Author:
+    __slots__ = ("name", "orcid", "openalex_id", "s2_id", "affiliation", "count", "last_reference")
+
+    def __init__(self, name, orcid=None, openalex_id=None, s2_id=None, affiliation=None):
+        self.name = name
+        self.orcid = orcid
+        self.openalex_id = openalex_id
+        self.s2_id = s2_id
+        self.affiliation = affiliation
+        # number of matched references the author is on
+        self.count = 0
+        # so an author listed twice on one reference is only counted once
+        self.last_reference = None
+
+    def keys(self):
+        """
+        Every key the author can be found under, strongest identifier first.
+        """
+        keys = [("orcid", self.orcid), ("openalex", self.openalex_id), ("s2", self.s2_id)]
+        keys = [key for key in keys if key[1]]
+        if not keys and self.name:
+            keys.append(("name", " ".join(self.name.lower().split())))
+        return keys
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "last_reference"}
+
+    def __repr__(self):
+        ids = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in ("orcid", "openalex_id", "s2_id", "affiliation") if getattr(self, slot))
+        return f"Author({self.name!r}{', ' + ids if ids else ''}, count={self.count})"
+
+
+class AuthorStore:
+    def __init__(self, failed=False):
+        # True if a lookup behind this store hit an error, so authors may be missing rather than not exist
+        self.failed = failed
+        # key -> Author, one Author can sit under several keys (e.g. its ORCID and its OpenAlex ID)
+        self._by_key = {}
+        # unique authors in the order they were first seen
+        self._authors = []
+
+    def add(self, reference, name, orcid=None, openalex_id=None, s2_id=None, affiliation=None):
+        """
+        Record that an author is on a matched reference. Returns the interned Author.
+        An author already in the store is reused and gains any IDs it was missing.
+        """
+        candidate = Author(name, normalize_orcid(orcid), normalize_openalex_id(openalex_id), s2_id, affiliation)
+        author = None
+        for key in candidate.keys():
+            author = self._by_key.get(key)
+            if author is not None:
+                break
+        if author is None:
+            author = candidate
+            self._authors.append(author)
+        else:
+            for slot in ("orcid", "openalex_id", "s2_id", "affiliation"):
+                if getattr(author, slot) is None:
+                    setattr(author, slot, getattr(candidate, slot))
+        for key in author.keys():
+            self._by_key.setdefault(key, author)
+        if reference is None or author.last_reference != reference:
+            author.count += 1
+            author.last_reference = reference
+        return author
+
+    def merge(self, other):
+        """
+        Add every author of another store, summing the counts of authors found in both.
+        """
+        self.failed = self.failed or other.failed
+        for author in other:
+            merged = None
+            for key in author.keys():
+                merged = self._by_key.get(key)
+                if merged is not None:
+                    break
+            if merged is None:
+                merged = Author(author.name, author.orcid, author.openalex_id, author.s2_id, author.affiliation)
+                self._authors.append(merged)
+            else:
+                for slot in ("orcid", "openalex_id", "s2_id", "affiliation"):
+                    if getattr(merged, slot) is None:
+                        setattr(merged, slot, getattr(author, slot))
+            merged.count += author.count
+            for key in merged.keys():
+                self._by_key.setdefault(key, merged)
+
+    def to_list(self):
+        """
+        Authors as plain dicts, e.g. to store them as JSON.
+        """
+        return [author.to_dict() for author in self._authors]
+
+    @classmethod
+    def from_list(cls, rows):
+        """
+        Rebuild a store from to_list() output, counts included.
+        """
+        store = cls()
+        for row in rows:
+            author = Author(row['name'], row['orcid'], row['openalex_id'], row['s2_id'], row['affiliation'])
+            author.count = row['count']
+            store._authors.append(author)
+            for key in author.keys():
+                store._by_key.setdefault(key, author)
+        return store
+
+    def ranked(self):
+        """
+        Authors on the most matched references first.
+        """
+        return sorted(self._authors, key=lambda author: author.count, reverse=True)
+
+    def __len__(self):
+        return len(self._authors)
+
+    def __iter__(self):
+        return iter(self._authors)
+
+    def __repr__(self):
+        return f"AuthorStore({self._authors!r})"
+
+
+def format_candidates(store, limit=MAX_CANDIDATES):
+    """
+    Ranked candidates as text, one line per author, e.g. for an Airtable long text field.
+    """
+    lines = []
+    for author in store.ranked()[:limit]:
+        details = [f"ORCID {author.orcid}" if author.orcid else None, author.affiliation]
+        details = ", ".join(detail for detail in details if detail)
+        references = "reference" if author.count == 1 else "references"
+        lines.append(f"{author.name}{f' ({details})' if details else ''} - {author.count} {references}")
+    return "\n".join(lines)
@@ -0,0 +1,216 @@
+"""
+
+Micro-benchmarks for the parsing and matching hot paths, run against the payloads in
+benchmarks/fixtures (see make_fixtures.py). No network access is needed.
+
+    python benchmarks/bench.py                  run everything and append the results to results/results.jsonl
+    python benchmarks/bench.py --save-baseline  also record this run as the baseline in results/baseline.json
+    python benchmarks/bench.py --compare        compare with the baseline, exit 1 on a regression
+    python benchmarks/bench.py -k pubmed        only benchmarks whose name contains "pubmed"
+
+Timings only mean something on the machine that made them, so results/ is not tracked:
+record a baseline on your machine before a change, then compare after it.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+FIXTURES = os.path.join(BENCH_DIR, "fixtures")
+RESULTS = os.path.join(BENCH_DIR, "results", "results.jsonl")
+BASELINE = os.path.join(BENCH_DIR, "results", "baseline.json")
+
+# The scripts read these at import time, nothing here talks to Airtable or OpenAI
+os.environ.setdefault("AIRTABLE_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("REFEREE_CACHE_DISABLED", "1")
+sys.path.insert(0, ROOT)
+
+import http_cache
+import pubmed_xml
+import referee_finder
+import relevance
+import tfidf
+from authors import AuthorStore
+from llm_text import chunk_text
+from pubmed import PubMedSearcher
+
+REPEAT = 5
+# A benchmark this much slower than the baseline counts as a regression
+REGRESSION = 0.20
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def json_response(name):
+    return http_cache.build_response(f"https://api.openalex.org/{name}", 200, {"Content-Type": "application/json"}, fixture(name))
+
+
+def repeat_articles(xml, times):
+    # A bigger PubmedArticleSet made of the same articles several times over, the parser doesn't care about duplicate PMIDs
+    start = xml.index(b"<PubmedArticle>")
+    end = xml.rindex(b"</PubmedArticleSet>")
+    return xml[:start] + xml[start:end] * times + xml[end:]
+
+
+def build_cases():
+    """
+    {name: zero-argument callable}, fixtures are loaded once here so only the work itself is timed.
+    """
+    cases = {}
+
+    concepts_methods = ("Concepts: " + "; ".join(f"concept number {i}" for i in range(20))
+                        + " Methods: " + "; ".join(f"method number {i}" for i in range(20)))
+    cases["split_concepts_and_methods"] = lambda: referee_finder.split_concepts_and_methods(concepts_methods)
+
+    work = json_response("openalex_work.json")
+    search = json_response("openalex_search.json")
+
+    def match_references():
+        state = referee_finder.PreprintState("benchmark")
+        state.add_references(referee_finder.reference_table("benchmark", work))
+        referee_finder.check_reference(search, state)
+        return state.final_references
+    cases["reference_table+check_reference"] = match_references
+
+    xml = {1: fixture("pubmed_1.xml"), 50: fixture("pubmed_50.xml")}
+    xml[500] = repeat_articles(xml[50], 10)
+    for count, payload in xml.items():
+        # What get_pubmed_references does with an efetch response
+        cases[f"pubmed_references_{count}"] = (
+            lambda payload=payload: [ref["pubmed"] for article in pubmed_xml.iter_articles(payload)
+                                     for ref in article["references"] if "pubmed" in ref]
+        )
+
+    searcher = PubMedSearcher(client=object())
+    articles = ET.fromstring(xml[50]).findall("PubmedArticle")
+    cases["PubMedSearcher._extract_references_50"] = lambda: [searcher._extract_references(article) for article in articles]
+
+    batch_authors = fixture("s2_batch_authors.json")
+
+    def s2_authors():
+        store = AuthorStore()
+        for reference in json.loads(batch_authors):
+            if reference is None:
+                continue
+            for author in reference["authors"]:
+                store.add(reference.get("paperId"), author["name"], s2_id=author["authorId"])
+        return store
+    cases["s2_batch_authors"] = s2_authors
+
+    records = list(pubmed_xml.iter_articles(xml[50]))
+    texts = {record["pmid"]: f"{record['title']} {record['abstract']}" for record in records}
+    methods = ["single cell rna sequencing", "mouse model", "neutralisation assay", "pcr", "antibody response"]
+    cases["relevance.prefilter_50"] = lambda: relevance.prefilter(texts, methods)
+    cases["tfidf.score_batch_50"] = lambda: tfidf.score_batch({"benchmark": (" ; ".join(methods), texts)})
+
+    text = " ".join(record["abstract"] for record in records)
+    cases["chunk_text"] = lambda: chunk_text(text, 1000)
+    return cases
+
+
+def measure(func, repeat=REPEAT):
+    """
+    Best time per call in seconds, over repeat rounds of as many calls as fit in about 0.2s.
+    """
+    # Garbage left by the previous benchmark shouldn't be collected on this one's time
+    gc.collect()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE):
+        return None
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the parsing and matching hot paths on recorded fixtures.")
+    parser.add_argument("-k", dest="pattern", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--compare", action="store_true", help="Compare with results/baseline.json and exit 1 if anything got slower than --threshold allows")
+    parser.add_argument("--threshold", type=float, default=REGRESSION,
+                        help="Slowdown that counts as a regression, raise it on noisy shared machines (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the baseline later runs are compared with")
+    parser.add_argument("--no-save", action="store_true", help="Don't append this run to results/results.jsonl")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        previous = load_baseline()
+        if previous is None:
+            sys.exit(f"No baseline in {BASELINE}, record one with --save-baseline first")
+        if (previous.get("machine"), previous.get("python")) != (platform.machine(), platform.python_version()):
+            print(f"Warning: the baseline was recorded on {previous.get('machine')} with Python {previous.get('python')}")
+    results = {}
+    regressions = []
+    for name, func in build_cases().items():
+        if args.pattern not in name:
+            continue
+        seconds = measure(func)
+        if previous and name in previous["results"] and seconds / previous["results"][name] - 1 > args.threshold:
+            # Measured again before calling it a regression, one noisy round shouldn't fail the comparison
+            seconds = min(seconds, measure(func))
+        results[name] = seconds
+        line = f"{name:<40} {format_time(seconds):>12}"
+        if previous and name in previous["results"]:
+            change = seconds / previous["results"][name] - 1
+            line += f"  {change:+.0%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    run = {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    if not args.no_save:
+        with open(RESULTS, "a") as f:
+            f.write(json.dumps(run) + "\n")
+    if args.save_baseline:
+        # Benchmarks left out by -k keep their old baseline
+        baseline = load_baseline() or {"results": {}}
+        run["results"] = {**baseline["results"], **results}
+        with open(BASELINE, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {BASELINE}")
+    if regressions:
+        print(f"{len(regressions)} benchmarks slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
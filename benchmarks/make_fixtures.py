@@ -0,0 +1,181 @@
+"""
+
+Writes the benchmark fixtures in benchmarks/fixtures.
+The payloads have the shape of real API responses (field names, nesting, typical sizes) but
+synthetic, seeded content, so they can be committed and rebuilt identically:
+
+    openalex_work.json      a preprint from /works/{id}, 60 referenced works
+    openalex_search.json    one page of /works?filter=... with 200 results, select=id
+    s2_references.json      /paper/{id}?fields=references, 60 references
+    s2_batch_authors.json   /paper/batch?fields=authors for 60 papers
+    pubmed_1.xml            efetch PubmedArticleSet with 1 article
+    pubmed_50.xml           efetch PubmedArticleSet with 50 articles
+
+The 500-article set is built from pubmed_50.xml by bench.py.
+"""
+import json
+import os
+import random
+import xml.etree.ElementTree as ET
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+WORDS = (
+    "cell cells sequencing rna single analysis immune response infection virus viral model mouse "
+    "protein expression gene genes clinical patients cohort tuberculosis diagnostic accuracy assay "
+    "spike antibody neutralisation vaccine wastewater degradation concentration pcr helicase "
+    "inhibitor antiviral culture surveillance genomic influenza clade emergence samples method "
+    "results we show that these data suggest novel approach using measured increased reduced"
+).split()
+FIRST_NAMES = "Anna Ben Chen David Elena Fatima George Hana Ivan Julia Kofi Lena Mateo Nadia Omar Priya".split()
+LAST_NAMES = "Smith Garcia Wang Kumar Okafor Muller Rossi Tanaka Silva Novak Haddad Jensen Costa Ivanova".split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def abstract(rng, sentences=10):
+    return " ".join(sentence(rng, rng.randint(12, 24)) for _ in range(sentences))
+
+
+def work_id(rng):
+    return f"https://openalex.org/W{rng.randint(1000000000, 4999999999)}"
+
+
+def openalex_work(rng, referenced_works):
+    return {
+        "id": "https://openalex.org/W4390000001",
+        "doi": "https://doi.org/10.1101/2024.01.01.000001",
+        "title": sentence(rng, 14),
+        "display_name": sentence(rng, 14),
+        "publication_year": 2024,
+        "type": "preprint",
+        "authorships": [
+            {
+                "author_position": "first" if i == 0 else "middle",
+                "author": {
+                    "id": f"https://openalex.org/A{rng.randint(5000000000, 5999999999)}",
+                    "display_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    "orcid": f"https://orcid.org/0000-000{rng.randint(1, 9)}-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+                },
+                "institutions": [{"id": "https://openalex.org/I1", "display_name": "University of Somewhere"}],
+            }
+            for i in range(8)
+        ],
+        "referenced_works_count": len(referenced_works),
+        "referenced_works": referenced_works,
+        "cited_by_count": rng.randint(0, 40),
+    }
+
+
+def openalex_search(rng, referenced_works, results=200):
+    # About a third of the results are works the preprint cites
+    ids = rng.sample(referenced_works, len(referenced_works) // 3)
+    ids += [work_id(rng) for _ in range(results - len(ids))]
+    rng.shuffle(ids)
+    return {
+        "meta": {"count": 1843, "db_response_time_ms": 41, "page": None, "per_page": results, "next_cursor": "IlsxNzAwMDAwMDAwMDAwXSI="},
+        "results": [{"id": link} for link in ids],
+        "group_by": [],
+    }
+
+
+def s2_paper_id(rng):
+    return "".join(rng.choice("0123456789abcdef") for _ in range(40))
+
+
+def s2_references(rng, count=60):
+    references = []
+    for _ in range(count):
+        # Some references S2 couldn't resolve have no paperId
+        paper_id = s2_paper_id(rng) if rng.random() > 0.1 else None
+        references.append({"paperId": paper_id, "title": sentence(rng, 10)})
+    return {"paperId": s2_paper_id(rng), "references": references}
+
+
+def s2_batch_authors(rng, references):
+    results = []
+    for reference in references["references"]:
+        if reference["paperId"] is None:
+            continue
+        if rng.random() < 0.05:
+            results.append(None)
+            continue
+        results.append({
+            "paperId": reference["paperId"],
+            "authors": [
+                {"authorId": str(rng.randint(1000000, 299999999)), "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"}
+                for _ in range(rng.randint(2, 12))
+            ],
+        })
+    return results
+
+
+def pubmed_article(rng, pmid, references=40):
+    article = ET.Element("PubmedArticle")
+    medline = ET.SubElement(article, "MedlineCitation", Status="MEDLINE", Owner="NLM")
+    ET.SubElement(medline, "PMID", Version="1").text = str(pmid)
+    info = ET.SubElement(medline, "Article", PubModel="Print-Electronic")
+    journal = ET.SubElement(info, "Journal")
+    issue = ET.SubElement(journal, "JournalIssue", CitedMedium="Internet")
+    ET.SubElement(issue, "Volume").text = str(rng.randint(1, 300))
+    pub_date = ET.SubElement(issue, "PubDate")
+    ET.SubElement(pub_date, "Year").text = str(rng.randint(2005, 2024))
+    ET.SubElement(pub_date, "Month").text = rng.choice(["Jan", "Mar", "Jun", "Sep", "Dec"])
+    ET.SubElement(journal, "Title").text = "Journal of " + sentence(rng, 3).rstrip(".")
+    ET.SubElement(info, "ArticleTitle").text = sentence(rng, 14)
+    abstract_element = ET.SubElement(info, "Abstract")
+    ET.SubElement(abstract_element, "AbstractText").text = abstract(rng)
+    author_list = ET.SubElement(info, "AuthorList", CompleteYN="Y")
+    for _ in range(rng.randint(3, 15)):
+        author = ET.SubElement(author_list, "Author", ValidYN="Y")
+        ET.SubElement(author, "LastName").text = rng.choice(LAST_NAMES)
+        ET.SubElement(author, "ForeName").text = rng.choice(FIRST_NAMES)
+        ET.SubElement(author, "Initials").text = "A"
+        affiliation = ET.SubElement(author, "AffiliationInfo")
+        ET.SubElement(affiliation, "Affiliation").text = f"Department of {rng.choice(WORDS).capitalize()}, University of Somewhere."
+    types = ET.SubElement(info, "PublicationTypeList")
+    ET.SubElement(types, "PublicationType", UI="D016428").text = "Journal Article"
+    pubmed_data = ET.SubElement(article, "PubmedData")
+    ids = ET.SubElement(pubmed_data, "ArticleIdList")
+    ET.SubElement(ids, "ArticleId", IdType="pubmed").text = str(pmid)
+    ET.SubElement(ids, "ArticleId", IdType="doi").text = f"10.{rng.randint(1000, 9999)}/{rng.randint(100000, 999999)}"
+    reference_list = ET.SubElement(pubmed_data, "ReferenceList")
+    for _ in range(references):
+        reference = ET.SubElement(reference_list, "Reference")
+        ET.SubElement(reference, "Citation").text = f"{rng.choice(LAST_NAMES)} A, et al. {sentence(rng, 10)} {rng.randint(1990, 2024)}."
+        if rng.random() > 0.2:
+            reference_ids = ET.SubElement(reference, "ArticleIdList")
+            ET.SubElement(reference_ids, "ArticleId", IdType="pubmed").text = str(rng.randint(10000000, 39999999))
+    return article
+
+
+def pubmed_set(rng, count):
+    root = ET.Element("PubmedArticleSet")
+    for i in range(count):
+        root.append(pubmed_article(rng, 30000000 + i))
+    return b'<?xml version="1.0" ?>\n<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2024//EN" "https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_240101.dtd">\n' + ET.tostring(root)
+
+
+def main():
+    rng = random.Random(2024)
+    os.makedirs(FIXTURES, exist_ok=True)
+    referenced_works = [work_id(rng) for _ in range(60)]
+    references = s2_references(rng)
+    payloads = {
+        "openalex_work.json": json.dumps(openalex_work(rng, referenced_works)).encode(),
+        "openalex_search.json": json.dumps(openalex_search(rng, referenced_works)).encode(),
+        "s2_references.json": json.dumps(references).encode(),
+        "s2_batch_authors.json": json.dumps(s2_batch_authors(rng, references)).encode(),
+        "pubmed_1.xml": pubmed_set(rng, 1),
+        "pubmed_50.xml": pubmed_set(rng, 50),
+    }
+    for name, payload in payloads.items():
+        with open(os.path.join(FIXTURES, name), "wb") as f:
+            f.write(payload)
+        print(f"wrote {name} ({len(payload)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+
+NCBI E-utilities client shared by the PubMed workflows.
+Every call goes through one pooled keep-alive session, so requests reuse TCP/TLS connections
+to eutils.ncbi.nlm.nih.gov. Fetches PubMed articles in batches instead of one efetch request
+per PMID, using the History server (WebEnv/query_key) for large reference lists.
+"""
+import io
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import xml.etree.ElementTree as ET
+import http_cache
+import pubmed_xml
+from rate_limit import RateLimitedSession
+
+base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+email = "your-email@example.com"  # Required by NCBI for API usage
+api_key = os.getenv('NCBI_API_KEY')
+
+# efetch accepts about 200 comma-separated ids per request
+EFETCH_BATCH_SIZE = 200
+# Lists longer than this go through the History server (epost + paged efetch)
+HISTORY_THRESHOLD = 200
+# Number of articles per efetch page when paging through a WebEnv
+HISTORY_PAGE_SIZE = 500
+# Max number of open connections to NCBI, callers wait for a free one past that
+POOL_SIZE = 10
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 60)
+
+
+class EutilsClient:
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT, email=email, api_key=api_key, before_send=None):
+        self.base_url = base_url
+        # Called with the URL before every request that goes out (not cache hits), it may raise to stop the request
+        self.before_send = before_send
+        self.email = email
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = RateLimitedSession()
+        # pool_block makes the pool size a hard cap on requests in flight
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    def _send(self, url, method="GET", **kwargs):
+        if self.before_send is not None:
+            self.before_send(url)
+        # With an API key NCBI allows 10 requests/second instead of 3, see rate_limit.LIMITS
+        if self.api_key:
+            key = "data" if method == "POST" else "params"
+            kwargs[key] = {**(kwargs.get(key) or {}), "api_key": self.api_key}
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def request(self, url, method="GET", **kwargs):
+        """
+        Send a request through the shared response cache and the pooled session.
+        """
+        return http_cache.cache.request(url, method=method, send=self._send, **kwargs)
+
+    def epost(self, pmids):
+        """
+        Upload a list of PMIDs to the NCBI History server.
+        Returns the (WebEnv, query_key) pair that later requests use to refer to the list.
+        """
+        epost_url = f"{self.base_url}/epost.fcgi"
+        data = {"db": "pubmed", "id": ",".join(pmids), "email": self.email}
+        # A WebEnv expires after a few hours, so never serve one from the cache
+        response = self._send(epost_url, method="POST", data=data)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        webenv = root.findtext("WebEnv")
+        query_key = root.findtext("QueryKey")
+        if not webenv or not query_key:
+            raise requests.RequestException(f"epost did not return a WebEnv: {root.findtext('ERROR')}")
+        return webenv, query_key
+
+    def _batch_pages(self, pmids, batch_size):
+        """
+        Yield the body of one PubmedArticleSet per batch of ids sent directly to efetch.
+        """
+        fetch_url = f"{self.base_url}/efetch.fcgi"
+        for i in range(0, len(pmids), batch_size):
+            data = {
+                "db": "pubmed",
+                "id": ",".join(pmids[i:i + batch_size]),
+                "retmode": "xml",
+                "email": self.email,
+            }
+            # POST keeps long id lists out of the URL
+            response = self.request(fetch_url, method="POST", data=data)
+            response.raise_for_status()
+            yield io.BytesIO(response.content)
+
+    def _history_pages(self, pmids, page_size):
+        """
+        Post the ids once with epost, then page through efetch with retstart/retmax on the WebEnv.
+        Pages are yielded as open streams so they are parsed while they download.
+        """
+        fetch_url = f"{self.base_url}/efetch.fcgi"
+        webenv, query_key = self.epost(pmids)
+        for retstart in range(0, len(pmids), page_size):
+            params = {
+                "db": "pubmed",
+                "WebEnv": webenv,
+                "query_key": query_key,
+                "retstart": retstart,
+                "retmax": page_size,
+                "retmode": "xml",
+                "email": self.email,
+            }
+            # The WebEnv differs every run, caching these pages would only fill the cache
+            with self._send(fetch_url, params=params, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                yield response.raw
+
+    def iter_articles(self, pmids, batch_size=EFETCH_BATCH_SIZE, use_history=None):
+        """
+        Yield a compact record (see pubmed_xml.article_record) for each article of a list of PMIDs.
+        Short lists go to efetch batch_size ids at a time; lists longer than HISTORY_THRESHOLD
+        (or any list with use_history=True) are posted to the History server once and paged through.
+        PMIDs NCBI returned nothing for are skipped.
+        Raises requests.RequestException if a request fails.
+        """
+        pmids = list(dict.fromkeys(pmid for pmid in pmids if pmid))
+        if use_history is None:
+            use_history = len(pmids) > HISTORY_THRESHOLD
+        if use_history:
+            pages = self._history_pages(pmids, HISTORY_PAGE_SIZE)
+        else:
+            pages = self._batch_pages(pmids, batch_size)
+        for page in pages:
+            yield from pubmed_xml.iter_articles(page)
+
+    def fetch_articles(self, pmids, batch_size=EFETCH_BATCH_SIZE, use_history=None):
+        """
+        Same as iter_articles, collected into a dict of {pmid: record}.
+        """
+        return {
+            record["pmid"]: record
+            for record in self.iter_articles(pmids, batch_size, use_history)
+            if record["pmid"]
+        }
+
+
+# Shared by every module that talks to NCBI
+client = EutilsClient()
@@ -1,15 +1,30 @@
 import os
+import logging
+import time
 from pyairtable import Api
 import requests
-import time
 import openai
 import dspy
 from dotenv import load_dotenv
 import re
+import argparse
 import xml.etree.ElementTree as ET
+import eutils
+import pubmed_xml
+import relevance
+import tfidf
+import http_cache
+import airtable_sync
+import rate_limit
+import llm_cache
+from llm_text import estimate_tokens
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 #global_methods = []
 # Get API keys from environment variables
 AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
@@ -34,6 +49,19 @@ model_name = "gpt-4o"
 lm = dspy.LM(f"openai/{model_name}", cache=False)
 dspy.settings.configure(lm=lm)
 
+# Batched extraction: abstracts per LLM request, estimated abstract tokens per request and requests in flight
+LLM_BATCH_SIZE = 5
+LLM_BATCH_TOKENS = 3000
+LLM_WORKERS = 4
+# Estimated tokens per request on top of the abstracts (instructions, methods list, reasoning and answer);
+# every request takes its estimate from the tokens-per-minute budget in rate_limit.LIMITS["openai"]
+LLM_OVERHEAD_TOKENS = 600
+# Bump when MethodExtractor or BatchMethodExtractor change, cached results of older prompts are then dropped
+PROMPT_VERSION = "1"
+extraction_cache = llm_cache.ExtractionCache(PROMPT_VERSION, enabled=not os.getenv('REFEREE_LLM_CACHE_DISABLED'))
+# "[3] method one, method two" lines in a batch answer
+BATCH_LINE_RE = re.compile(r"^\s*\[(\d+)\]\s*:?\s*(.*)$", re.M)
+
 class MethodExtractor(dspy.Signature):
     """Extract scientific concepts and methods from text."""
     text = dspy.InputField()
@@ -49,47 +77,126 @@ class ExtractorProgram(dspy.Module):
         result = self.extractor(text=text, global_methods=global_methods)
         return result.methods
 
-# Initialize DSPy programs
-#extractor_program = ExtractorProgram()
+class BatchMethodExtractor(dspy.Signature):
+    """Extract the methods used in each of several numbered abstracts."""
+    abstracts = dspy.InputField(desc="Abstracts, each starting with its number in square brackets, e.g. [1]")
+    global_methods = dspy.InputField()
+    methods = dspy.OutputField(desc="One line per abstract, in the form '[number] method, method'. Only use methods from global_methods that the abstract uses. Write '[number] none' if an abstract uses none of them.")
 
-def chunk_text(text, max_tokens):
-    """Split text into chunks that fit within token limits."""
-    words = text.split()
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for word in words:
-        # Rough estimate: 1 word ≈ 1.3 tokens
-        word_tokens = len(word) * 1.3
-        if current_length + word_tokens > max_tokens:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [word]
-            current_length = word_tokens
-        else:
-            current_chunk.append(word)
-            current_length += word_tokens
-    
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    return chunks
+class BatchExtractorProgram(dspy.Module):
+    def __init__(self):
+        super().__init__()
+        self.extractor = dspy.ChainOfThought(BatchMethodExtractor)
 
+    def forward(self, abstracts, global_methods):
+        result = self.extractor(abstracts=abstracts, global_methods=global_methods)
+        return result.methods
+
+# Initialize DSPy programs
+#extractor_program = ExtractorProgram()
 
 def analyze_content(text, preprint_methods):
-    """Analyze text content using DSPy to extract concepts and methods."""
+    """Analyze text content using DSPy to extract concepts and methods. None if the LLM call failed."""
+    key = extraction_cache.key(text, preprint_methods, model_name, "single")
+    methods = extraction_cache.get(key)
+    if methods is not None:
+        return methods
+    tokens = estimate_tokens(text) + LLM_OVERHEAD_TOKENS
+    waited = rate_limit.limiter.acquire("openai", tokens)
+    start = time.monotonic()
     try:
         extractor_program = ExtractorProgram()
         # Use DSPy to extract concepts and methods
         methods_str = extractor_program(text, preprint_methods)
+        metrics.registry.record("openai", "analyze_content", "ok", time.monotonic() - start, rate_limit_wait=waited, tokens=tokens)
         # Split the comma-separated strings into lists
         methods = [m.strip() for m in methods_str.split(',') if m.strip()]
-        
+        # Failed calls aren't cached so they are tried again next time
+        extraction_cache.set(key, methods)
         return methods
     except Exception as e:
-        print(f"Error in DSPy analysis: {e}")
-        return []
+        metrics.registry.record("openai", "analyze_content", "error", time.monotonic() - start, rate_limit_wait=waited)
+        log.error("Error in DSPy analysis: %s", e)
+        return None
+
+def make_batches(abstracts, max_size=LLM_BATCH_SIZE, max_tokens=LLM_BATCH_TOKENS):
+    """Group reference ids so each group's abstracts fit in one LLM request."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for ref, abstract in abstracts.items():
+        tokens = estimate_tokens(abstract)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(ref)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def parse_batch_methods(output, refs):
+    """Map the numbered lines of a batch answer back to reference ids. Abstracts without a line are left out."""
+    found = {}
+    for match in BATCH_LINE_RE.finditer(output or ""):
+        index = int(match.group(1)) - 1
+        if not 0 <= index < len(refs):
+            continue
+        text = match.group(2).strip()
+        if text.lower() in ("none", "[]", ""):
+            found[refs[index]] = []
+            continue
+        methods = [m.strip().strip('[]"\'').strip() for m in text.split(',')]
+        found[refs[index]] = [m for m in methods if m]
+    return found
+
+def analyze_batch(refs, abstracts, preprint_methods):
+    """Extract methods for several abstracts with one LLM request. Returns {ref: methods}."""
+    text = "\n\n".join(f"[{i}] {abstracts[ref]}" for i, ref in enumerate(refs, 1))
+    tokens = estimate_tokens(text) + LLM_OVERHEAD_TOKENS
+    waited = rate_limit.limiter.acquire("openai", tokens)
+    start = time.monotonic()
+    try:
+        output = BatchExtractorProgram()(text, preprint_methods)
+    except Exception as e:
+        metrics.registry.record("openai", "analyze_batch", "error", time.monotonic() - start, rate_limit_wait=waited)
+        log.error("Error in DSPy batch analysis: %s", e)
+        return {}
+    metrics.registry.record("openai", "analyze_batch", "ok", time.monotonic() - start, rate_limit_wait=waited, tokens=tokens)
+    return parse_batch_methods(output, refs)
+
+def extract_methods_batched(abstracts, preprint_methods, workers=LLM_WORKERS):
+    """
+    Extract methods for {ref: abstract} with batched requests run on a bounded thread pool.
+    Abstracts the model skipped in its batch answer are asked about one at a time, those whose
+    single request failed too are None.
+    """
+    results = {}
+    keys = {ref: extraction_cache.key(abstract, preprint_methods, model_name, "batch") for ref, abstract in abstracts.items()}
+    for ref, key in keys.items():
+        methods = extraction_cache.get(key)
+        if methods is not None:
+            results[ref] = methods
+    # Only abstracts that aren't cached are sent
+    uncached = {ref: abstract for ref, abstract in abstracts.items() if ref not in results}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = make_batches(uncached)
+        for found in executor.map(lambda refs: analyze_batch(refs, uncached, preprint_methods), batches):
+            for ref, methods in found.items():
+                extraction_cache.set(keys[ref], methods)
+            results.update(found)
+        missing = [ref for ref in uncached if ref not in results]
+        for ref, methods in zip(missing, executor.map(lambda ref: analyze_content(uncached[ref], preprint_methods), missing)):
+            results[ref] = methods
+    log.info("Extracted methods for %d abstracts: %d cached, %d batched and %d single requests",
+             len(abstracts), len(abstracts) - len(uncached), len(batches), len(missing))
+    return results
 
 def get_id(paper, doi):
+    # PMID of the preprint, None if PubMed doesn't have it; a failed request raises requests.RequestException
+    if not doi:
+        return None
     search_url = f"{pubmed_base_url}/esearch.fcgi"
     params = {
          "db": "pubmed",
@@ -99,8 +206,7 @@ def get_id(paper, doi):
          "email": email
      }
     try:
-        response = requests.get(search_url, params=params)
-        time.sleep(2)
+        response = eutils.client.request(search_url, params=params)
         response.raise_for_status()
         root = ET.fromstring(response.content)
         pmids = []
@@ -119,22 +225,23 @@ def get_id(paper, doi):
             "email": email
         }
         try:
-            response = requests.get(search_url, params=params)
+            response = eutils.client.request(search_url, params=params)
             response.raise_for_status()
             root = ET.fromstring(response.content)
             for pmid_elem in root.findall(".//Id"):
                 if pmid_elem.text in pmids:
                     return pmid_elem.text
         except requests.RequestException as e:
-            print(f"Error searching PubMed for DOI: {e}")
-            return []
+            log.error("Error searching PubMed for DOI: %s", e)
+            raise
 
     except requests.RequestException as e:
 
-        print(f"Error searching PubMed: {e}")
-        return []
+        log.error("Error searching PubMed: %s", e)
+        raise
 
 def get_pubmed_references(id):
+    # PMIDs the article cites, None if there's no such article; a failed request raises requests.RequestException
     fetch_url = f"{pubmed_base_url}/efetch.fcgi"
     params = {
         "db": "pubmed", 
@@ -142,72 +249,134 @@ def get_pubmed_references(id):
         "retmode": "xml", 
         "email": email
         }
-    references = []
-
     try:
-        response = requests.get(fetch_url, params=params)
+        response = eutils.client.request(fetch_url, params=params)
         response.raise_for_status()
-        root = ET.fromstring(response.content)
-        article = root.find(".//PubmedArticle")
+        article = next(pubmed_xml.iter_articles(response.content), None)
         if article is None:
             return None
-        reference_list = article.find(".//ReferenceList")
-        if reference_list is not None:
-            for ref in reference_list.findall(".//Reference"):
-                ref_info = {}
-                # Article IDs in references (PMID, DOI, etc.)
-                article_ids = ref.findall(".//ArticleId")
-                for aid in article_ids:
-                    id_type = aid.get("IdType") 
-                    #print(id_type)
-                    if id_type == "pubmed" and aid.text:
-                        references.append(aid.text)
+        # PMIDs of the references that have one
+        references = [ref["pubmed"] for ref in article["references"] if "pubmed" in ref]
         return references
     except requests.RequestException as e:
-        print(f"Error fetching references for ID {id}: {e}")
-        return None
+        log.error("Error fetching references for ID %s: %s", id, e)
+        raise
 
-def get_ref_info(reference_list, preprint_methods):
+def get_ref_info(reference_list, preprint_methods, method_mode="llm", prefilter=(relevance.MATCH_THRESHOLD, relevance.REJECT_THRESHOLD)):
+    # prefilter is (match threshold, reject threshold) for relevance.prefilter, or None to send every reference to the LLM
+    # returns None if the references or their methods couldn't be fetched
     paper_and_methods = {}
-    fetch_url = f"{pubmed_base_url}/efetch.fcgi"
-    for ref in reference_list[1:20]:
+    # LLM extraction costs tokens per reference so only part of the list is used, BM25 scores every reference
+    selected = reference_list[1:20] if method_mode in ("llm", "llm-batch") else reference_list
+    for ref in selected:
         paper_and_methods.update({ref: {"title": "", "authors": [], "abstract": "", "methods": ""}})
-        params = {
-            "db": "pubmed", 
-            "id": ref, 
-            "retmode": "xml", 
-            "email": email
-        }
-        try:
-            response = requests.get(fetch_url, params = params)
-            time.sleep(2)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)
-            article = root.find(".//PubmedArticle")
-            title_elem = article.find(".//ArticleTitle")
-            paper_and_methods[ref]["title"] = title_elem.text if title_elem is not None else "N/A"
-            authors = []
-            for author in article.findall(".//Author"):
-                lastname = author.find(".//LastName")
-                forename = author.find(".//ForeName")
-                affiliation = author.find(".//AffiliationInfo/Affiliation")
-                authors.append(f"{forename.text if forename is not None else ""} {lastname.text if lastname is not None else ""} (affiliation: {affiliation.text if affiliation is not None else 'N/A'})")
-            paper_and_methods[ref]["authors"] = authors
-            abstract_elem = article.find(".//Abstract/AbstractText")
-            paper_and_methods[ref]["abstract"] = abstract_elem.text if abstract_elem is not None else "N/A"
+    # One efetch request for the whole batch of references
+    try:
+        articles = eutils.client.fetch_articles(list(paper_and_methods))
+    except requests.RequestException as e:
+        log.error("Error fetching articles for IDs %s: %s", ", ".join(paper_and_methods), e)
+        return None
+    found = []
+    for ref in paper_and_methods:
+        article = articles.get(ref)
+        if article is None:
+            log.warning("No article found for ID %s.", ref)
+            continue
+        paper_and_methods[ref]["title"] = article["title"] if article["title"] is not None else "N/A"
+        authors = []
+        for forename, lastname, affiliation in article["authors"]:
+            name = pubmed_xml.author_name(forename, lastname)
+            if name is not None:
+                authors.append(f"{name} (affiliation: {affiliation if affiliation is not None else 'N/A'})")
+        paper_and_methods[ref]["authors"] = authors
+        paper_and_methods[ref]["abstract"] = article["abstract"] if article["abstract"] is not None else "N/A"
+        found.append(ref)
+    if method_mode in ("llm", "llm-batch"):
+        to_extract = found
+        if prefilter is not None:
+            # Clear matches and clear misses are decided locally, only the rest go to the LLM
+            texts = {
+                ref: f"{paper_and_methods[ref]['title']} {paper_and_methods[ref]['abstract']}"
+                if paper_and_methods[ref]["abstract"] != "N/A" else ""
+                for ref in found
+            }
+            decided, to_extract = relevance.prefilter(texts, preprint_methods, *prefilter)
+            for ref, methods in decided.items():
+                paper_and_methods[ref]["methods"] = methods
+            matched = sum(1 for methods in decided.values() if methods)
+            log.info("Pre-filter: %d matched, %d rejected, %d sent to the LLM", matched, len(decided) - matched, len(to_extract))
+    if method_mode == "llm":
+        for ref in to_extract:
             #text_chunks = chunk_text      paper_and_methods[ref]["abstract"], 1000)
             #for chunk in text_chunks:
             methods = analyze_content(paper_and_methods[ref]["abstract"], preprint_methods)
                 #print(methods)
             paper_and_methods[ref]["methods"] = methods  # methods
-        except requests.RequestException as e:
-            print(f"Error fetching article for ID {ref}: {e}")
-            continue
+    if method_mode == "llm-batch":
+        # References without an abstract have nothing to extract from
+        abstracts = {ref: paper_and_methods[ref]["abstract"] for ref in to_extract if paper_and_methods[ref]["abstract"] not in ("", "N/A")}
+        extracted = extract_methods_batched(abstracts, preprint_methods)
+        for ref in to_extract:
+            paper_and_methods[ref]["methods"] = extracted.get(ref, [])
+    if method_mode in ("llm", "llm-batch"):
+        # A failed extraction isn't the same as no methods, the record is left for the next run
+        # (extractions that worked are cached, so only the failed ones are sent again)
+        failed = [ref for ref in to_extract if paper_and_methods[ref]["methods"] is None]
+        if failed:
+            log.error("Method extraction failed for %d references: %s", len(failed), ", ".join(failed))
+            return None
+    if method_mode == "bm25":
+        return rank_references(paper_and_methods, preprint_methods)
     return paper_and_methods
 
+def select_by_similarity(batch, min_score=tfidf.MIN_SCORE):
+    """
+    Score the references of a batch of preprints against each preprint's methods with TF-IDF in one pass.
+    batch is {title: (preprint methods, paper_and_methods)}. Each reference gets its cosine similarity as "score",
+    and the authors of references scoring at least min_score go into final_references, best match first.
+    """
+    scores = tfidf.score_batch({
+        title: (" ; ".join(preprint_methods), {
+            ref: f"{info['title']} {info['abstract'] if info['abstract'] != 'N/A' else ''}"
+            for ref, info in paper_and_methods.items()
+        })
+        for title, (preprint_methods, paper_and_methods) in batch.items()
+    })
+    for title, (preprint_methods, paper_and_methods) in batch.items():
+        final_references.update({title: {"authors": []}})
+        for ref, score in sorted(scores[title].items(), key=lambda item: item[1], reverse=True):
+            paper_and_methods[ref]["score"] = score
+            if score >= min_score:
+                final_references[title]["authors"].append(paper_and_methods[ref]["authors"])
+            else:
+                log.debug("%s not suitable for referee (similarity %.2f)", ref, score)
+
+def rank_references(paper_and_methods, preprint_methods):
+    """
+    Score every reference's title and abstract against the preprint's methods with BM25.
+    Each reference gets the preprint methods it mentions as "methods" and its BM25 "score";
+    references are returned best match first.
+    """
+    index = relevance.BM25Index({
+        ref: f"{info['title']} {info['abstract'] if info['abstract'] != 'N/A' else ''}"
+        for ref, info in paper_and_methods.items()
+    })
+    ranked = {}
+    for ref, score, matched in index.rank(preprint_methods):
+        paper_and_methods[ref]["methods"] = matched
+        paper_and_methods[ref]["score"] = score
+        ranked[ref] = paper_and_methods[ref]
+    # References that mention none of the methods go last
+    for ref, info in paper_and_methods.items():
+        if ref not in ranked:
+            info["methods"] = []
+            info["score"] = 0.0
+            ranked[ref] = info
+    return ranked
+
 def get_preprint_methods(concepts_methods):
     if not concepts_methods:
-        print("Concepts and Methods not found in the string.")
+        log.warning("Concepts and Methods not found in the string.")
         return [], []
     else:
         pos = concepts_methods.find('Methods:')
@@ -218,17 +387,16 @@ def get_preprint_methods(concepts_methods):
     
 final_references = {}
 
-def main():
-    records = table1.all(view='Proposals')
-    
-    records_to_update = [
-        record for record in records
-        if (record['fields'].get('Status') == 'To Pitch(Editorial)'
-            or record['fields'].get('Status') == 'Selected')
-        and (record['fields'].get('Updated Concepts'))
-            # or record['fields'].get('Updated Concepts').strip() == '')
-    ]
-    for record in records_to_update[1:2]:
+def main(method_mode="llm", incremental=True, clear_llm_cache=False, prefilter=(relevance.MATCH_THRESHOLD, relevance.REJECT_THRESHOLD),
+         min_score=tfidf.MIN_SCORE):
+    if clear_llm_cache:
+        extraction_cache.clear()
+    #only records that are new or changed since the last run, unless incremental is off
+    checkpoint = airtable_sync.Checkpoint('get_concepts_pubmed') if incremental else None
+    records_to_update = list(airtable_sync.pending_records(table1, checkpoint))
+    # tfidf mode scores every preprint's references together once they are all fetched
+    tfidf_batch = {}
+    for record in records_to_update[0:1]:
         preprint_references = []
         fields = record['fields']
         title = fields['Title']
@@ -239,13 +407,31 @@ def main():
         concepts_methods=fields.get('Updated Concepts')
 
         #print(doi)
-        id = get_id(title, doi)
-        refs = get_pubmed_references(id)
+        #records whose lookups failed are not checkpointed, so the next run tries them again
+        try:
+            id = get_id(title, doi)
+            refs = get_pubmed_references(id) if id else None
+        except requests.RequestException:
+            log.warning("PubMed lookup failed for %s, leaving it for the next run.", title)
+            continue
+        #many preprints aren't in PubMed, that's an answer too and the record is done
+        if not refs:
+            log.info("%s is not in PubMed or has no references there.", title)
+            if checkpoint:
+                checkpoint.mark(record)
+            continue
         preprint_methods = get_preprint_methods(concepts_methods)
         preprint_clean = [m.strip().lower() for m in preprint_methods]
         #extractor_program = ExtractorProgram()
-        methods = get_ref_info(refs, preprint_clean)
-        final_references.update({title: {"authors": []}})
+        methods = get_ref_info(refs, preprint_clean, method_mode, prefilter)
+        if methods is None:
+            log.warning("Fetching reference methods failed for %s, leaving it for the next run.", title)
+            continue
+        if method_mode == "tfidf":
+            tfidf_batch[title] = (preprint_clean, methods)
+            methods = {}
+        else:
+            final_references.update({title: {"authors": []}})
         for method in methods:
             ref_methods = [m.strip().lower() for m in methods[method]["methods"]]
             
@@ -258,12 +444,42 @@ def main():
                 final_references[title]["authors"].append(methods[method]["authors"])
              #   print(f"{method} has common methods: {list(common)}")
             else:
-                print(f"{method} not suitable for referee")
+                log.debug("%s not suitable for referee", method)
+        if checkpoint:
+            checkpoint.mark(record)
+    if tfidf_batch:
+        select_by_similarity(tfidf_batch, min_score)
+    if checkpoint:
+        checkpoint.save()
     print(final_references)
+    print(http_cache.cache.summary())
+    print(extraction_cache.summary())
+    metrics.registry.export("get_concepts_pubmed")
+    print(metrics.registry.report())
 
             
         
         
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Find potential referees for preprints from their PubMed references.")
+    parser.add_argument("--methods", choices=["llm", "llm-batch", "bm25", "tfidf"], default="llm",
+                        help="llm: extract each reference's methods with DSPy (first references only), "
+                             "llm-batch: same with several abstracts per request and requests run in parallel, "
+                             "bm25: rank every reference locally against the preprint's methods, "
+                             "tfidf: score every reference of every preprint by TF-IDF cosine similarity in one pass (default: llm)")
+    parser.add_argument("--min-score", type=float, default=tfidf.MIN_SCORE,
+                        help="Similarity a reference needs in tfidf mode (default: %(default)s)")
+    parser.add_argument("--all", action="store_true", help="Process every matching record, not only those new or changed since the last run")
+    parser.add_argument("--clear-llm-cache", action="store_true", help="Drop every cached method extraction before running")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every reference to the LLM instead of deciding clear matches and misses locally")
+    parser.add_argument("--prefilter-match", type=float, default=relevance.MATCH_THRESHOLD,
+                        help="Share of a method's words and word pairs a reference must contain to match without the LLM (default: %(default)s)")
+    parser.add_argument("--prefilter-reject", type=float, default=relevance.REJECT_THRESHOLD,
+                        help="References whose best method overlap is at or below this are rejected without the LLM (default: %(default)s)")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING or ERROR (default: $REFEREE_LOG_LEVEL or INFO)")
+    args = parser.parse_args()
+    metrics.setup_logging(args.log_level)
+    prefilter = None if args.no_prefilter else (args.prefilter_match, args.prefilter_reject)
+    main(method_mode=args.methods, incremental=not args.all, clear_llm_cache=args.clear_llm_cache, prefilter=prefilter,
+         min_score=args.min_score)
     
@@ -0,0 +1,269 @@
+"""
+
+On-disk HTTP response cache shared by the OpenAlex, Semantic Scholar and PubMed clients.
+Responses are stored in SQLite keyed by the normalized URL, params and body, with a TTL per
+source (a short one for title/DOI searches, whose empty results aren't stored), zlib-compressed
+bodies and size-based LRU eviction. Set REFEREE_CACHE_DISABLED=1 to
+bypass it.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlparse, parse_qsl
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import metrics
+
+CACHE_PATH = os.getenv('REFEREE_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http_cache.sqlite'))
+# Least recently used responses are evicted once the stored bodies pass this size
+MAX_SIZE = int(os.getenv('REFEREE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+DAY = 24 * 60 * 60
+# Which source each API host belongs to, requests to other hosts are never cached
+SOURCES = {
+    "api.openalex.org": "openalex",
+    "api.semanticscholar.org": "semantic_scholar",
+    "eutils.ncbi.nlm.nih.gov": "pubmed",
+}
+# How long a cached response stays fresh, in seconds
+TTLS = {
+    "openalex": 7 * DAY,
+    "semantic_scholar": 7 * DAY,
+    "pubmed": 30 * DAY,
+}
+# Searches answer "is this preprint indexed yet", which changes from one day to the next,
+# so they get a short TTL instead of their source's, and empty results aren't cached at all
+SEARCH_TTL = int(os.getenv('REFEREE_CACHE_SEARCH_TTL', 6 * 60 * 60))
+ESEARCH_EMPTY_RE = re.compile(rb"<Count>0</Count>")
+# Expired entries are swept and the size total re-read from disk at most this often, in seconds
+SWEEP_INTERVAL = 60
+# Params that don't change the response and shouldn't split the cache
+IGNORED_PARAMS = {"email", "tool", "api_key"}
+# Headers that describe the raw transfer, not the decoded body we store
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+def make_key(method, url, params=None, data=None, json_body=None):
+    """
+    Hash a request into a cache key. Query string and params are merged and sorted,
+    so the same request gives the same key however it was built.
+    """
+    parts = urlparse(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += list(params.items()) if isinstance(params, dict) else list(params)
+    query = sorted((k, str(v)) for k, v in query if k not in IGNORED_PARAMS)
+    if isinstance(data, dict):
+        data = sorted((k, str(v)) for k, v in data.items() if k not in IGNORED_PARAMS)
+    canonical = json.dumps(
+        [method.upper(), parts.scheme.lower(), parts.netloc.lower(), parts.path, query, data, json_body],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_search(source, url, params=None):
+    """
+    True for title/DOI lookups: NCBI esearch, OpenAlex title.search filters and S2 paper search.
+    """
+    parts = urlparse(url)
+    if source == "pubmed":
+        return parts.path.endswith("/esearch.fcgi")
+    if source == "semantic_scholar":
+        return "/paper/search" in parts.path
+    if source == "openalex":
+        return "title.search" in parts.query or "title.search" in str(params or "")
+    return False
+
+
+def is_empty_search(source, body):
+    # A search that found nothing, checked on the raw body of a search response
+    try:
+        if source == "pubmed":
+            return ESEARCH_EMPTY_RE.search(body) is not None
+        if source == "openalex":
+            return json.loads(body)["meta"]["count"] == 0
+        if source == "semantic_scholar":
+            return not json.loads(body).get("data")
+    except (ValueError, KeyError, TypeError):
+        return False
+    return False
+
+
+def build_response(url, status, headers, body):
+    """
+    Rebuild a requests.Response from a cached entry so callers can't tell the difference.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.url = url
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_size=MAX_SIZE, ttls=None, enabled=True):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = dict(TTLS if ttls is None else ttls)
+        self.enabled = enabled
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        # Running total of the stored body sizes, so storing a response doesn't have to sum the table
+        self._size = 0
+        self._swept = 0.0
+
+    def _connect(self):
+        # Opened on first use so importing a client doesn't touch the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    source TEXT,
+                    url TEXT,
+                    status INTEGER,
+                    headers TEXT,
+                    body BLOB,
+                    size INTEGER,
+                    created REAL,
+                    accessed REAL,
+                    expires REAL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+            conn.commit()
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _count(self, source, stat, amount=1):
+        counts = self.stats.setdefault(source, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        counts[stat] += amount
+
+    def get(self, key, source):
+        """
+        Return (url, status, headers, body) for a fresh entry, or None.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT url, status, headers, body FROM responses WHERE key = ? AND expires > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self._count(source, "misses")
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self._count(source, "hits")
+        url, status, headers, body = row
+        return url, status, json.loads(headers), zlib.decompress(body)
+
+    def set(self, key, source, url, status, headers, body, ttl=None):
+        now = time.time()
+        ttl = self.ttls.get(source, 0) if ttl is None else ttl
+        headers = {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+        compressed = zlib.compress(body)
+        with self._lock:
+            conn = self._connect()
+            replaced = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, source, url, status, json.dumps(headers), compressed, len(compressed), now, now, now + ttl),
+            )
+            conn.commit()
+            self._size += len(compressed) - (replaced[0] if replaced else 0)
+            self._count(source, "stores")
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # Expired entries go every SWEEP_INTERVAL, then least recently used ones until we are back under max_size
+        if now - self._swept >= SWEEP_INTERVAL:
+            conn.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+            # Other processes write to the same file, so the running total is corrected here too
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._swept = now
+        if self._size > self.max_size:
+            excess = self._size - self.max_size
+            doomed = []
+            for key, source, size in conn.execute("SELECT key, source, size FROM responses ORDER BY accessed"):
+                doomed.append((key,))
+                self._count(source, "evictions")
+                excess -= size
+                self._size -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        conn.commit()
+
+    def clear(self, source=None):
+        """
+        Drop every cached response, or only those of one source.
+        """
+        with self._lock:
+            conn = self._connect()
+            if source is None:
+                conn.execute("DELETE FROM responses")
+            else:
+                conn.execute("DELETE FROM responses WHERE source = ?", (source,))
+            conn.commit()
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def request(self, url, method="GET", send=None, ttl=None, **kwargs):
+        """
+        Serve a request from the cache, or send it with send(url, method=..., **kwargs)
+        and store the response if it succeeded.
+        """
+        send = send or (lambda url, method="GET", **kwargs: requests.request(method, url, **kwargs))
+        source = SOURCES.get(urlparse(url).netloc.lower())
+        if not self.enabled or source is None:
+            return send(url, method=method, **kwargs)
+        key = make_key(method, url, kwargs.get("params"), kwargs.get("data"), kwargs.get("json"))
+        cached = self.get(key, source)
+        if cached is not None:
+            metrics.registry.record(source, metrics.endpoint(url), cached[1], size=len(cached[3]), cached=True)
+            return build_response(*cached)
+        response = send(url, method=method, **kwargs)
+        if 200 <= response.status_code < 300:
+            if ttl is None and is_search(source, url, kwargs.get("params")):
+                if is_empty_search(source, response.content):
+                    return response
+                ttl = SEARCH_TTL
+            self.set(key, source, response.url, response.status_code, response.headers, response.content, ttl)
+        return response
+
+    def summary(self):
+        """
+        One line per source with hit/miss statistics for this run.
+        """
+        lines = []
+        for source, counts in sorted(self.stats.items()):
+            lookups = counts["hits"] + counts["misses"]
+            rate = counts["hits"] / lookups * 100 if lookups else 0
+            lines.append(
+                f"{source}: {counts['hits']} hits, {counts['misses']} misses ({rate:.0f}% hit rate), "
+                f"{counts['stores']} stored, {counts['evictions']} evicted"
+            )
+        return "\n".join(lines) if lines else "HTTP cache: no lookups"
+
+
+cache = ResponseCache(enabled=not os.getenv('REFEREE_CACHE_DISABLED'))
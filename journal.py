@@ -0,0 +1,81 @@
+"""
+
+Append-only journal of finished pipeline stages, so an interrupted run can resume.
+Each line of the JSONL file records one stage of one Airtable record (e.g. the resolved
+preprint and its references, the matched references, the final authors) together with a
+hash of the record, so stages of a record that has since been edited are ignored.
+"""
+import json
+import os
+import threading
+import time
+
+from airtable_sync import record_hash
+
+JOURNAL_DIR = os.getenv('REFEREE_JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+
+class Journal:
+    def __init__(self, name, path=None):
+        self.path = path or os.path.join(JOURNAL_DIR, f'journal_{name}.jsonl')
+        # record id -> (record hash, {stage: data})
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line can be cut short if the run was killed mid-write
+                        continue
+                    self._remember(entry['record'], entry['hash'], entry['stage'], entry['data'])
+
+    def _remember(self, record_id, digest, stage, data):
+        stored_hash, stages = self.entries.get(record_id, (None, {}))
+        if stored_hash != digest:
+            stages = {}
+        stages[stage] = data
+        self.entries[record_id] = (digest, stages)
+
+    def get(self, record, stage):
+        """
+        Data journaled for a stage of a record, or None if the stage hasn't finished.
+        """
+        digest, stages = self.entries.get(record['id'], (None, {}))
+        if digest != record_hash(record):
+            return None
+        return stages.get(stage)
+
+    def put(self, record, stage, data):
+        """
+        Journal a finished stage. The line is flushed right away so it survives a crash or Ctrl-C.
+        """
+        entry = {'record': record['id'], 'hash': record_hash(record), 'stage': stage, 'data': data, 'time': time.time()}
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._remember(entry['record'], entry['hash'], stage, data)
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._file = open(self.path, 'a')
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def resumed(self):
+        """
+        Number of records with at least one journaled stage.
+        """
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Delete the journal, once a run has finished and nothing needs resuming.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,101 @@
+"""
+
+Persistent cache of LLM method extraction results.
+Results are keyed by a hash of the abstract, the normalized preprint method list, the model
+and the prompt, so an abstract cited by several preprints is only sent once per method list.
+Entries written with another PROMPT_VERSION are dropped when the cache is opened, and the least
+recently used entries are evicted past MAX_ENTRIES. Set REFEREE_LLM_CACHE_DISABLED=1 to bypass it.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_PATH = os.getenv('REFEREE_LLM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm_cache.sqlite'))
+MAX_ENTRIES = int(os.getenv('REFEREE_LLM_CACHE_MAX_ENTRIES', 100000))
+
+
+def normalize_methods(methods):
+    return sorted({" ".join(method.lower().split()) for method in methods if method and method.strip()})
+
+
+def make_key(abstract, methods, model, prompt, prompt_version):
+    canonical = json.dumps([" ".join((abstract or "").split()), normalize_methods(methods), model, prompt, prompt_version])
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, prompt_version, path=LLM_CACHE_PATH, max_entries=MAX_ENTRIES, enabled=True):
+        self.prompt_version = prompt_version
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, prompt_version TEXT, methods TEXT, created REAL, accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed)")
+            # Results of an older prompt are never looked up again
+            conn.execute("DELETE FROM extractions WHERE prompt_version != ?", (self.prompt_version,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def key(self, abstract, methods, model, prompt):
+        return make_key(abstract, methods, model, prompt, self.prompt_version)
+
+    def get(self, key):
+        """
+        Cached list of methods, or None.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT methods FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE extractions SET accessed = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def set(self, key, methods):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+                (key, self.prompt_version, json.dumps(methods), now, now),
+            )
+            self.stats["stores"] += 1
+            # Least recently used entries go once we are over max_entries
+            conn.execute(
+                "DELETE FROM extractions WHERE key IN (SELECT key FROM extractions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM extractions")
+            conn.commit()
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        rate = self.stats["hits"] / lookups * 100 if lookups else 0
+        return f"LLM cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({rate:.0f}% hit rate), {self.stats['stores']} stored"
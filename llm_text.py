@@ -0,0 +1,33 @@
+"""
+
+Token estimates and text chunking for the LLM requests in get_concepts_pubmed.
+Kept free of dspy/openai so they can be imported (and benchmarked) without the LLM stack.
+"""
+
+
+def estimate_tokens(text):
+    # Rough estimate: 1 word ≈ 1.3 tokens
+    return int(len(text.split()) * 1.3) + 1
+
+
+def chunk_text(text, max_tokens):
+    """Split text into chunks that fit within token limits."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    
+    for word in words:
+        # Rough estimate: 1 word ≈ 1.3 tokens
+        word_tokens = len(word) * 1.3
+        if current_length + word_tokens > max_tokens:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [word]
+            current_length = word_tokens
+        else:
+            current_chunk.append(word)
+            current_length += word_tokens
+    
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    return chunks
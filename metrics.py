@@ -0,0 +1,146 @@
+"""
+
+Per-request instrumentation for every outbound API call.
+RateLimitedSession, the response cache, the LLM calls and the Airtable writer record the
+source, endpoint, status, latency, bytes, retries and rate-limit wait of each call here.
+export() writes a per-run summary as JSON and as a Prometheus textfile (for the node_exporter
+textfile collector). setup_logging() configures the leveled key=value logging the scripts use
+instead of print for diagnostics.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+METRICS_DIR = os.getenv('REFEREE_METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'metrics'))
+LOG_FORMAT = "%(asctime)s level=%(levelname)s logger=%(name)s msg=%(message)s"
+
+# Path segments with digits that are at least this long are IDs, e.g. W4390000001 or a 40 character S2 paperId
+ID_SEGMENT_RE = re.compile(r"/(?=[^/]*\d)[^/]{6,}")
+
+
+def endpoint(url):
+    """
+    Path of a URL with IDs replaced by {id}, so calls to the same endpoint are counted together.
+    """
+    return ID_SEGMENT_RE.sub("/{id}", urlparse(url).path) or "/"
+
+
+def setup_logging(level=None):
+    """
+    Leveled key=value logging on stderr, level from the argument or $REFEREE_LOG_LEVEL (default INFO).
+    """
+    level = level or os.getenv('REFEREE_LOG_LEVEL', 'INFO')
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO), format=LOG_FORMAT)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        # (source, endpoint, status, cached) -> totals
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, source, endpoint, status, latency=0.0, size=0, retries=0, rate_limit_wait=0.0, cached=False, tokens=0):
+        """
+        Count one call. latency excludes rate_limit_wait, which is the time spent waiting for a token.
+        size is response bytes, tokens the estimated LLM tokens of the call.
+        """
+        key = (source, endpoint, str(status), cached)
+        with self._lock:
+            totals = self.calls.setdefault(key, {"count": 0, "latency": 0.0, "max_latency": 0.0, "bytes": 0, "tokens": 0, "retries": 0, "rate_limit_wait": 0.0})
+            totals["count"] += 1
+            totals["latency"] += latency
+            totals["max_latency"] = max(totals["max_latency"], latency)
+            totals["bytes"] += size
+            totals["tokens"] += tokens
+            totals["retries"] += retries
+            totals["rate_limit_wait"] += rate_limit_wait
+
+    def record_response(self, source, url, response, latency, rate_limit_wait=0.0, stream=False):
+        # A streamed body hasn't been read yet, fall back to Content-Length
+        if stream:
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content or b"")
+        self.record(source, endpoint(url), response.status_code, latency, size,
+                    getattr(response, "retries", 0), rate_limit_wait, getattr(response, "from_cache", False))
+
+    def summary(self):
+        """
+        Totals per call type and per source for this run.
+        """
+        with self._lock:
+            calls = [
+                {"source": source, "endpoint": path, "status": status, "cached": cached, **totals}
+                for (source, path, status, cached), totals in sorted(self.calls.items(), key=lambda item: str(item[0]))
+            ]
+        sources = {}
+        for call in calls:
+            totals = sources.setdefault(call["source"], {"count": 0, "cached": 0, "latency": 0.0, "bytes": 0, "tokens": 0, "retries": 0, "rate_limit_wait": 0.0})
+            totals["count"] += call["count"]
+            totals["cached"] += call["count"] if call["cached"] else 0
+            for field in ("latency", "bytes", "tokens", "retries", "rate_limit_wait"):
+                totals[field] += call[field]
+        return {"started": self.started, "duration": time.time() - self.started, "sources": sources, "calls": calls}
+
+    def prometheus(self, job):
+        """
+        The summary in Prometheus text exposition format.
+        """
+        summary = self.summary()
+        metrics = [
+            ("referee_requests_total", "counter", "Outbound API calls", "count"),
+            ("referee_request_seconds_total", "counter", "Time spent in API calls, excluding rate limit waits", "latency"),
+            ("referee_request_max_seconds", "gauge", "Slowest single API call", "max_latency"),
+            ("referee_response_bytes_total", "counter", "Response body bytes", "bytes"),
+            ("referee_llm_tokens_total", "counter", "Estimated LLM tokens", "tokens"),
+            ("referee_request_retries_total", "counter", "Retries after 429/503 responses", "retries"),
+            ("referee_rate_limit_wait_seconds_total", "counter", "Time spent waiting for a rate limit token", "rate_limit_wait"),
+        ]
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for call in summary["calls"]:
+                labels = (f'job="{job}",source="{call["source"]}",endpoint="{call["endpoint"]}",'
+                          f'status="{call["status"]}",cached="{str(call["cached"]).lower()}"')
+                lines.append(f"{name}{{{labels}}} {call[field]}")
+        lines.append("# HELP referee_run_duration_seconds Duration of the run")
+        lines.append("# TYPE referee_run_duration_seconds gauge")
+        lines.append(f'referee_run_duration_seconds{{job="{job}"}} {summary["duration"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, job, directory=METRICS_DIR):
+        """
+        Write <job>.json and <job>.prom to directory. Returns the summary.
+        """
+        summary = self.summary()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{job}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        # Written to a temporary file first, the textfile collector must never read a half-written file
+        prom_path = os.path.join(directory, f"{job}.prom")
+        with open(f"{prom_path}.tmp", "w") as f:
+            f.write(self.prometheus(job))
+        os.replace(f"{prom_path}.tmp", prom_path)
+        return summary
+
+    def report(self):
+        """
+        One line per source: calls, cached calls, time in calls, time waiting for rate limits, bytes (or LLM tokens).
+        """
+        lines = []
+        for source, totals in sorted(self.summary()["sources"].items()):
+            volume = f"{totals['tokens']} tokens" if totals["tokens"] else f"{totals['bytes'] / 1024:.0f} KiB"
+            lines.append(
+                f"{source}: {totals['count']} calls ({totals['cached']} cached), {totals['latency']:.1f}s in calls, "
+                f"{totals['rate_limit_wait']:.1f}s rate limited, {totals['retries']} retries, {volume}"
+            )
+        return "\n".join(lines) if lines else "No API calls"
+
+
+registry = Metrics()
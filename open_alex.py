@@ -1,10 +1,14 @@
 import requests
 import sys
+from rate_limit import RateLimitedSession
 
 search_url = "https://api.openalex.org/works?filter=title.search:"
 papers = ["Integrated treatment-decision algorithms for childhood TB: modelling diagnostic performance and costs", "Post-sampling degradation of viral RNA in wastewater impacts the quality of PCR-based concentration estimates", "Emetine dihydrochloride inhibits Chikungunya virus nsP2 helicase and shows antiviral activity in the cell culture and mouse model of virus infection", "Diagnostic Accuracy of Swab-Based Molecular Tests for Tuberculosis Using Novel Near-Point-Of-Care Platforms: A Multi-Country Evaluation", "Neutralisation and Antibody-Dependent Cellular Cytotoxicity Functions Map to Distinct SARS-CoV-2 Spike Subdomains and Vaccine Platforms"]
 
 reference_info = {}
+session_alex = RateLimitedSession()
+# max number of work IDs OpenAlex accepts in one openalex_id filter
+batch_size = 50
 '''
 so...
 request.get(url for preprint)
@@ -20,24 +24,26 @@ def get_info(paper, reference_link, response):
         return
     #set up dict structure
     reference_info.update({paper: {"authors": []}})
-    for reference in response.json()['referenced_works']:
-        # Convert reference link to API URL
-        reference_link = reference[:8] + 'api.' + reference[8:]
-        print(reference_link)
-        response = requests.get(reference_link)
+    referenced_works = response.json()['referenced_works']
+    # Look up authorships for up to batch_size referenced works per request
+    for i in range(0, len(referenced_works), batch_size):
+        chunk = [reference.rsplit('/', 1)[-1] for reference in referenced_works[i:i + batch_size]]
+        url = f"https://api.openalex.org/works?filter=openalex_id:{'|'.join(chunk)}&select=id,authorships&per_page={batch_size}"
+        print(url)
+        response = session_alex.get(url)
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
-            print(f"An error occurred while fetching referenced paper {reference}: {e}")
+            print(f"An error occurred while fetching referenced papers {', '.join(chunk)}: {e}")
             continue
-        authors = response.json()['authorships']
-        for author in authors:
-            reference_info[paper]["authors"].append({author['author']['display_name'], author['author']['orcid']})
+        for work in response.json()['results']:
+            for author in work['authorships']:
+                reference_info[paper]["authors"].append({author['author']['display_name'], author['author']['orcid']})
 
 def main():
     #search for specific preprint
     for paper in papers:
-        response = requests.get(search_url + paper)
+        response = session_alex.get(search_url + paper)
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -51,7 +57,7 @@ def main():
         # Convert preprint link to API URL
         preprint_link = preprint_link[:8] + 'api.' + preprint_link[8:] 
 
-        response = requests.get(preprint_link)
+        response = session_alex.get(preprint_link)
 
         get_info(paper, preprint_link, response)
     #print(reference_info)
@@ -11,11 +11,19 @@ import requests
 import xml.etree.ElementTree as ET
 import json
 import argparse
+import logging
+import eutils
+import metrics
+import pubmed_xml
+
+log = logging.getLogger(__name__)
 
 class PubMedSearcher:
-    def __init__(self):
+    def __init__(self, client=None):
         self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
         self.email = "your-email@example.com"  # Required by NCBI for API usage
+        # Pooled keep-alive session shared by every request this searcher makes
+        self.client = client or eutils.client
     
     def search_by_title(self, title):
         """
@@ -54,7 +62,7 @@ class PubMedSearcher:
 
         try:
 
-            response = requests.get(search_url, params=params)
+            response = self.client.request(search_url, params=params)
             response.raise_for_status()
             root = ET.fromstring(response.content)
 
@@ -66,7 +74,7 @@ class PubMedSearcher:
 
         except requests.RequestException as e:
 
-            print(f"Error searching PubMed: {e}")
+            log.error("Error searching PubMed: %s", e)
 
             return []
 
@@ -77,96 +85,56 @@ class PubMedSearcher:
         fetch_url = f"{self.base_url}/efetch.fcgi"
         params = {"db": "pubmed", "id": pmid, "retmode": "xml", "email": self.email}
         try:
-            response = requests.get(fetch_url, params=params)
+            response = self.client.request(fetch_url, params=params)
             response.raise_for_status()
-            root = ET.fromstring(response.content)
-            article = root.find(".//PubmedArticle")
+            # Stream the response into a compact record instead of building the whole tree
+            article = next(pubmed_xml.iter_articles(response.content), None)
             if article is None:
                 return None
             # Extract article information
             info = {}
             # Title
-            title_elem = article.find(".//ArticleTitle")
-            info["title"] = title_elem.text if title_elem is not None else "N/A"
+            info["title"] = article["title"] if article["title"] is not None else "N/A"
             # Authors
             authors = []
-            for author in article.findall(".//Author"):
-                lastname = author.find("LastName")
-                forename = author.find("ForeName")
+            for forename, lastname, affiliation in article["authors"]:
                 if lastname is not None and forename is not None:
-                    authors.append(f"{forename.text} {lastname.text}")
+                    authors.append(f"{forename} {lastname}")
 
                 elif lastname is not None:
-                    authors.append(lastname.text)
+                    authors.append(lastname)
             info["authors"] = authors
             # Journal
-            journal_elem = article.find(".//Journal/Title")
-            info["journal"] = journal_elem.text if journal_elem is not None else "N/A"
+            info["journal"] = article["journal"] if article["journal"] is not None else "N/A"
             # Publication date
-            pub_date = article.find(".//PubDate")
-            if pub_date is not None:
-                year = pub_date.find("Year")
-                month = pub_date.find("Month")
-                day = pub_date.find("Day")
-                date_parts = []
-                if year is not None:
-                    date_parts.append(year.text)
-                if month is not None:
-                    date_parts.append(month.text)
-                if day is not None:
-                    date_parts.append(day.text)
-                info["publication_date"] = " ".join(date_parts) if date_parts else "N/A"
-            else:
-                info["publication_date"] = "N/A"
+            info["publication_date"] = article["publication_date"] or "N/A"
 
             # Abstract
-            abstract_elem = article.find(".//Abstract/AbstractText")
             info["abstract"] = (
-                abstract_elem.text if abstract_elem is not None else "N/A"
+                article["abstract"] if article["abstract"] is not None else "N/A"
             )
             # DOI
-            doi_elem = article.find('.//ArticleId[@IdType="doi"]')
-            info["doi"] = doi_elem.text if doi_elem is not None else "N/A"
+            info["doi"] = article["doi"] if article["doi"] is not None else "N/A"
             # PMID
             info["pmid"] = pmid
             # Check if it's a preprint
-            publication_types = []
-            for pub_type in article.findall(".//PublicationType"):
-                if pub_type.text:
-                    publication_types.append(pub_type.text)
+            publication_types = article["publication_types"]
             info["publication_types"] = publication_types
             info["is_preprint"] = any(
                 "preprint" in pt.lower() for pt in publication_types
             )
-            # Extract references
-            info["references"] = self._extract_references(article)
+            # References were already extracted while parsing
+            info["references"] = article["references"]
             return info
         except requests.RequestException as e:
-            print(f"Error fetching article details: {e}")
+            log.error("Error fetching article details: %s", e)
             return None
 
     def _extract_references(self, article):
         """
         Extract reference list from the article XML.
         """
-        references = []
-        reference_list = article.find(".//ReferenceList")
-        if reference_list is not None:
-            for ref in reference_list.findall(".//Reference"):
-                ref_info = {}
-                # Reference citation text
-                citation = ref.find(".//Citation")
-                if citation is not None and citation.text:
-                    ref_info["citation"] = citation.text.strip()
-                # Article IDs in references (PMID, DOI, etc.)
-                article_ids = ref.findall(".//ArticleId")
-                for aid in article_ids:
-                    id_type = aid.get("IdType")
-                    if id_type and aid.text:
-                        ref_info[f"{id_type}"] = aid.text
-                if ref_info:  # Only add if we found some info
-                    references.append(ref_info)
-        return references
+        return pubmed_xml.extract_references(article)
 
     def get_similar_papers(self, pmid, max_results=5):
         """
@@ -183,7 +151,7 @@ class PubMedSearcher:
             "email": self.email,
         }
         try:
-            response = requests.get(elink_url, params=params)
+            response = self.client.request(elink_url, params=params)
             response.raise_for_status()
             root = ET.fromstring(response.content)
             similar_pmids = []
@@ -214,7 +182,7 @@ class PubMedSearcher:
             return similar_papers
 
         except requests.RequestException as e:
-            print(f"Error fetching similar papers: {e}")
+            log.error("Error fetching similar papers: %s", e)
             return []
 
     def _is_doi(self, text):
@@ -245,12 +213,12 @@ class PubMedSearcher:
         """
         if self._is_doi(search_term):
 
-            print(f"Searching by DOI: '{search_term}'")
+            log.info("Searching by DOI: '%s'", search_term)
 
             pmids = self.search_by_doi(search_term)
 
         else:
-            print(f"Searching by title: '{search_term}'")
+            log.info("Searching by title: '%s'", search_term)
             pmids = self.search_by_title(search_term)
         print("-" * 50)
         if not pmids:
@@ -263,7 +231,7 @@ class PubMedSearcher:
             if article_info:
                 # Add similar papers if requested
                 if include_similar:
-                    print(f"Fetching similar papers for PMID {pmid}...")
+                    log.info("Fetching similar papers for PMID %s...", pmid)
                     article_info["similar_papers"] = self.get_similar_papers(pmid)
 
                 else:
@@ -376,8 +344,14 @@ Examples:
         "--output", "-o", help="Output JSON file name (default: auto-generated)"
     )
 
+    parser.add_argument(
+        "--log-level", default=None, help="DEBUG, INFO, WARNING or ERROR (default: $REFEREE_LOG_LEVEL or INFO)"
+    )
+
     args = parser.parse_args()
 
+    metrics.setup_logging(args.log_level)
+
     searcher = PubMedSearcher()
 
     results = searcher.search_preprint(
@@ -400,6 +374,9 @@ Examples:
             json.dump(results, f, indent=2)
         print(f"\nResults saved to: {output_file}")
 
+    metrics.registry.export("pubmed")
+    print(metrics.registry.report())
+
 if __name__ == "__main__":
 
     main()
@@ -0,0 +1,106 @@
+"""
+
+Streaming parser for PubMed efetch XML.
+Walks a PubmedArticleSet with iterparse and yields one compact record per PubmedArticle,
+clearing each article as soon as it has been read so memory stays flat however large the
+response is.
+"""
+import io
+import xml.etree.ElementTree as ET
+
+
+def extract_references(article):
+    """
+    Extract the reference list from a PubmedArticle element.
+    Returns a list of {"citation": text, <IdType>: id} dicts, skipping references with no info.
+    """
+    references = []
+    reference_list = article.find("PubmedData/ReferenceList")
+    if reference_list is None:
+        return references
+    for ref in reference_list.iter("Reference"):
+        ref_info = {}
+        # Reference citation text
+        citation = ref.find("Citation")
+        if citation is not None and citation.text:
+            ref_info["citation"] = citation.text.strip()
+        # Article IDs in references (PMID, DOI, etc.)
+        for aid in ref.iterfind("ArticleIdList/ArticleId"):
+            id_type = aid.get("IdType")
+            if id_type and aid.text:
+                ref_info[id_type] = aid.text
+        if ref_info:  # Only add if we found some info
+            references.append(ref_info)
+    return references
+
+
+def author_name(forename, lastname):
+    """
+    "Forename Lastname" for a person, None for entries without a LastName (e.g. a CollectiveName consortium).
+    """
+    if not lastname:
+        return None
+    return " ".join(part for part in (forename, lastname) if part)
+
+
+def article_record(article):
+    """
+    Build the compact record for one PubmedArticle element.
+    Missing values are None; authors are (forename, lastname, affiliation) tuples.
+    """
+    medline = article.find("MedlineCitation")
+    info = article.find("MedlineCitation/Article")
+    record = {
+        "pmid": medline.findtext("PMID") if medline is not None else None,
+        "title": None,
+        "authors": [],
+        "journal": None,
+        "publication_date": None,
+        "abstract": None,
+        "doi": None,
+        "publication_types": [],
+        "references": extract_references(article),
+    }
+    if info is not None:
+        record["title"] = info.findtext("ArticleTitle")
+        author_list = info.find("AuthorList")
+        if author_list is not None:
+            for author in author_list.iterfind("Author"):
+                record["authors"].append((
+                    author.findtext("ForeName"),
+                    author.findtext("LastName"),
+                    author.findtext("AffiliationInfo/Affiliation"),
+                ))
+        record["journal"] = info.findtext("Journal/Title")
+        pub_date = info.find("Journal/JournalIssue/PubDate")
+        if pub_date is not None:
+            date_parts = [pub_date.findtext(part) for part in ("Year", "Month", "Day")]
+            date_parts = [part for part in date_parts if part is not None]
+            record["publication_date"] = " ".join(date_parts) if date_parts else None
+        record["abstract"] = info.findtext("Abstract/AbstractText")
+        record["publication_types"] = [
+            pub_type.text for pub_type in info.iterfind("PublicationTypeList/PublicationType") if pub_type.text
+        ]
+    doi = article.find("PubmedData/ArticleIdList/ArticleId[@IdType='doi']")
+    record["doi"] = doi.text if doi is not None else None
+    return record
+
+
+def iter_articles(source):
+    """
+    Yield a compact record (see article_record) for every PubmedArticle in an efetch response.
+    source is raw bytes or a binary file-like object such as response.raw.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+            continue
+        if event != "end" or elem.tag not in ("PubmedArticle", "PubmedBookArticle"):
+            continue
+        if elem.tag == "PubmedArticle":
+            yield article_record(elem)
+        # Drop the finished article so the tree never holds more than one
+        root.clear()
@@ -1,12 +1,14 @@
 import re
 from pyairtable import Api
 import requests
-from requests_ratelimiter import LimiterSession
 import sys
 import os
-import time
 from dotenv import load_dotenv, dotenv_values
 import xml.etree.ElementTree as ET
+import eutils
+import pubmed_xml
+import http_cache
+import airtable_sync
 
 load_dotenv()
 
@@ -21,6 +23,9 @@ email = "your-email@example.com"
 
 '''Get PubMed ID for a given title and cross-check if the doi matches'''
 def get_id(title, doi):
+    # PMID of the preprint, None if PubMed doesn't have it; a failed request raises requests.RequestException
+    if not doi:
+        return None
     search_url = f"{pubmed_base_url}/esearch.fcgi"
     params = {
          "db": "pubmed",
@@ -30,8 +35,7 @@ def get_id(title, doi):
          "email": email
      }
     try:
-        response = requests.get(search_url, params=params)
-        time.sleep(2)
+        response = eutils.client.request(search_url, params=params)
         response.raise_for_status()
         root = ET.fromstring(response.content)
         pmids = []
@@ -50,7 +54,7 @@ def get_id(title, doi):
             "email": email
         }
         try:
-            response = requests.get(search_url, params=params)
+            response = eutils.client.request(search_url, params=params)
             response.raise_for_status()
             root = ET.fromstring(response.content)
             for pmid_elem in root.findall(".//Id"):
@@ -58,15 +62,16 @@ def get_id(title, doi):
                     return pmid_elem.text
         except requests.RequestException as e:
             print(f"Error searching PubMed for DOI: {e}")
-            return None
+            raise
 
     except requests.RequestException as e:
 
         print(f"Error searching PubMed: {e}")
-        return []
+        raise
 
 '''Get reference list for given PubMed ID'''
 def get_references(id):
+    # PMIDs the article cites, None if there's no such article; a failed request raises requests.RequestException
     fetch_url = f"{pubmed_base_url}/efetch.fcgi"
     params = {
         "db": "pubmed", 
@@ -74,78 +79,45 @@ def get_references(id):
         "retmode": "xml", 
         "email": email
         }
-    references = []
-
     try:
-        response = requests.get(fetch_url, params=params)
+        response = eutils.client.request(fetch_url, params=params)
         response.raise_for_status()
-        root = ET.fromstring(response.content)
-        article = root.find(".//PubmedArticle")
+        article = next(pubmed_xml.iter_articles(response.content), None)
         if article is None:
             return None
-        reference_list = article.find(".//ReferenceList")
-        if reference_list is not None:
-            for ref in reference_list.findall(".//Reference"):
-                # Article IDs in references (PMID, DOI, etc.)
-                article_ids = ref.findall(".//ArticleId")
-                for aid in article_ids:
-                    id_type = aid.get("IdType") 
-                    #print(id_type)
-                    if id_type == "pubmed" and aid.text:
-                        references.append(aid.text)
+        # PMIDs of the references that have one
+        references = [ref["pubmed"] for ref in article["references"] if "pubmed" in ref]
         return references
     except requests.RequestException as e:
         print(f"Error fetching references for ID {id}: {e}")
-        return None
+        raise
 
 
 def update_author_pubmed(reference_codes, title):
-    fetch_url = f"{pubmed_base_url}/efetch.fcgi"
     references.update({title: {"authors": []}})
+    print(f"fetching authors for {len(reference_codes)} references")
+    try:
+        articles = eutils.client.fetch_articles(reference_codes)
+    except requests.RequestException as e:
+        print(f"Error fetching references for {title}: {e}")
+        return None
     for ref in reference_codes:
-        params = { 
-            "db": "pubmed", 
-            "id": ref, 
-            "retmode": "xml", 
-            "email": email
-            }
-        try:
-            response = requests.get(fetch_url, params=params)
-            print("fetching authors for reference: ", ref)
-            time.sleep(2)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)
-            article = root.find(".//PubmedArticle")
-            if article is None:
-                print(f"No article found for ID {ref}.")
-                return None
-            author_list = article.find(".//AuthorList")
-            if author_list is not None:
-                for author in author_list.findall(".//Author"):
-                    first_name = author.find(".//ForeName")
-                    #print(first_name.text)
-                    last_name = author.find(".//LastName")
-                    #print(last_name.text)
-                    affiliation = author.find(".//AffiliationInfo/Affiliation")
-                    #print(affiliation.text)
-                    references[title]["authors"].append({f"{first_name.text} {last_name.text}", affiliation.text if affiliation is not None else "No Affiliation"})
-                    print("Successfully fetched authors for reference: ", ref)
-                    
-        except requests.RequestException as e:
-            print(f"Error fetching references for ID {id}: {e}")
-            return None
+        article = articles.get(ref)
+        if article is None:
+            print(f"No article found for ID {ref}.")
+            continue
+        for first_name, last_name, affiliation in article["authors"]:
+            name = pubmed_xml.author_name(first_name, last_name)
+            if name is None:
+                continue
+            references[title]["authors"].append({name, affiliation if affiliation is not None else "No Affiliation"})
+        print("Successfully fetched authors for reference: ", ref)
     return references
                 
-def main():
-    records = table1.all(view='Proposals')
-    
-    records_to_update = [
-        record for record in records
-        if (record['fields'].get('Status') == 'To Pitch(Editorial)'
-            or record['fields'].get('Status') == 'Selected')
-        and (record['fields'].get('Updated Concepts'))
-            # or record['fields'].get('Updated Concepts').strip() == '')
-    ]
+def main(incremental=True):
+    #only records that are new or changed since the last run, unless incremental is off
+    checkpoint = airtable_sync.Checkpoint('pubtest') if incremental else None
+    records_to_update = list(airtable_sync.pending_records(table1, checkpoint))
     for record in records_to_update[0:1]:
         preprint_references = []
         fields = record['fields']
@@ -155,13 +127,29 @@ def main():
         print(title)
         doi = fields.get('Link/DOI')
         print(doi)
-        id = get_id(title, doi)
-        print(id)
-        preprint_references = get_references(id)
+        #records whose lookups failed are not checkpointed, so the next run tries them again
+        try:
+            id = get_id(title, doi)
+            print(id)
+            preprint_references = get_references(id) if id else None
+        except requests.RequestException:
+            continue
         #print(preprint_references)
-        update_author_pubmed(preprint_references, title)
+        #not in PubMed (or no references there) is an answer too, the record is done
+        if not preprint_references:
+            if checkpoint:
+                checkpoint.mark(record)
+            continue
+        if update_author_pubmed(preprint_references, title) is None:
+            continue
+        if checkpoint:
+            checkpoint.mark(record)
+    if checkpoint:
+        checkpoint.save()
     print(references)
+    print(http_cache.cache.summary())
 
             
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    #pass --all to process every matching record, not only those new or changed since the last run
+    main(incremental="--all" not in sys.argv[1:])
\ No newline at end of file
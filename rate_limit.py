@@ -0,0 +1,222 @@
+"""
+
+Rate limiting shared by every API client.
+Each source has one or more token buckets stored in SQLite, so separate processes running
+against the same API share one budget. Responses are checked for Retry-After and
+X-RateLimit-* headers, and 429/503 responses are retried once the source may send again.
+"""
+import email.utils
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+from http_cache import SOURCES
+
+log = logging.getLogger(__name__)
+
+RATE_LIMIT_PATH = os.getenv('REFEREE_RATE_LIMIT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'rate_limits.sqlite'))
+
+DAY = 24 * 60 * 60
+# (requests, period in seconds) buckets per source, a request needs a token from each of them
+LIMITS = {
+    "openalex": [(10, 1), (100000, DAY)],
+    "semantic_scholar": [(1, 1)],
+    # NCBI allows 10 requests/second with an API key and 3 without
+    "pubmed": [(10, 1)] if os.getenv('NCBI_API_KEY') else [(3, 1)],
+    # Airtable allows 5 requests/second per base, taken by airtable_sync.RecordWriter
+    "airtable": [(5, 1)],
+    # Tokens per minute for LLM calls in get_concepts_pubmed, each call takes its estimated token count
+    "openai": [(int(os.getenv('OPENAI_TPM_BUDGET', 30000)), 60)],
+}
+# Statuses that mean "slow down and try again"
+RETRY_STATUSES = {429, 503}
+MAX_RETRIES = 5
+# Backoff base in seconds when a 429/503 comes without Retry-After
+BACKOFF = 2
+
+
+def parse_retry_after(value, now):
+    """
+    Retry-After is either a number of seconds or an HTTP date. Returns seconds to wait, or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value, now):
+    """
+    X-RateLimit-Reset is an epoch timestamp for some APIs and seconds from now for others.
+    Returns the epoch time the limit resets at, or None.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 1e9 else now + value
+
+
+class TokenBucketLimiter:
+    def __init__(self, path=RATE_LIMIT_PATH, limits=None):
+        self.path = path
+        self.limits = dict(LIMITS if limits is None else limits)
+        self._local = threading.local()
+
+    def _connect(self):
+        # One connection per thread, SQLite locking keeps threads and processes in step
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, source TEXT, tokens REAL, updated REAL, blocked_until REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _buckets(self, conn, source, now):
+        # Current (name, capacity, tokens, blocked_until) of every bucket of a source, refilled up to now
+        buckets = []
+        for count, period in self.limits.get(source, []):
+            name = f"{source}:{count}/{period}"
+            row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated, blocked_until = row if row else (count, now, 0)
+            tokens = min(count, tokens + max(0, now - updated) * count / period)
+            buckets.append((name, count, period, tokens, blocked_until))
+        return buckets
+
+    def _try_acquire(self, source, now, cost=1):
+        """
+        Take cost tokens from every bucket of the source. Returns 0 on success, else the seconds to wait.
+        A cost larger than a bucket waits for the full bucket instead.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            buckets = self._buckets(conn, source, now)
+            wait = 0
+            for name, count, period, tokens, blocked_until in buckets:
+                need = min(cost, count)
+                if blocked_until > now:
+                    wait = max(wait, blocked_until - now)
+                elif tokens < need:
+                    wait = max(wait, (need - tokens) * period / count)
+            if wait == 0:
+                for name, count, period, tokens, blocked_until in buckets:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)",
+                        (name, source, tokens - min(cost, count), now, blocked_until),
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, source, cost=1):
+        """
+        Block until the source may send another request (or spend cost tokens). Returns the seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(source, time.time(), cost)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, source, until):
+        """
+        Stop every process from sending to the source until the given epoch time.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name, count, period, tokens, blocked_until in self._buckets(conn, source, now):
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)",
+                    (name, source, tokens, now, max(blocked_until, until)),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def observe(self, source, response, attempt=0):
+        """
+        Read the rate limit headers of a response.
+        Returns the seconds to wait before retrying if the response should be retried, else None.
+        """
+        now = time.time()
+        retry_after = parse_retry_after(response.headers.get("Retry-After"), now)
+        if response.status_code in RETRY_STATUSES:
+            delay = retry_after if retry_after is not None else BACKOFF * 2 ** attempt
+            self.block(source, now + delay)
+            return delay
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.strip() == "0":
+            reset = parse_reset(response.headers.get("X-RateLimit-Reset"), now)
+            if reset is not None:
+                self.block(source, reset)
+        return None
+
+
+limiter = TokenBucketLimiter()
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests.Session that takes a token for the request's source before sending
+    and retries 429/503 responses. Hosts without a known source are sent as-is.
+    """
+    def __init__(self, limiter=limiter, max_retries=MAX_RETRIES):
+        super().__init__()
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlparse(url).netloc.lower()
+        source = SOURCES.get(host)
+        stream = kwargs.get("stream", False)
+        if source is None:
+            start = time.monotonic()
+            response = super().request(method, url, *args, **kwargs)
+            metrics.registry.record_response(host, url, response, time.monotonic() - start, stream=stream)
+            return response
+        waited = 0.0
+        retries = 0
+        latency = 0.0
+        while True:
+            waited += self.limiter.acquire(source)
+            start = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException:
+                metrics.registry.record(source, metrics.endpoint(url), "error", latency + time.monotonic() - start,
+                                        retries=retries, rate_limit_wait=waited)
+                raise
+            latency += time.monotonic() - start
+            delay = self.limiter.observe(source, response, retries)
+            if delay is None or retries >= self.max_retries:
+                break
+            log.warning("%s returned %s, retrying in %.1fs", source, response.status_code, delay)
+            retries += 1
+        # Kept on the response so callers can tell network time from time spent waiting
+        response.rate_limit_wait = waited
+        response.retries = retries
+        metrics.registry.record_response(source, url, response, latency, waited, stream=stream)
+        return response
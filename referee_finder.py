@@ -1,114 +1,270 @@
 from pyairtable import Api
 import requests
-from requests_ratelimiter import LimiterSession
-import sys
+from rate_limit import RateLimitedSession
 import os
-import time
 from dotenv import load_dotenv, dotenv_values
 import xml.etree.ElementTree as ET
 import re
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+import logging
+from urllib.parse import urlparse
+from functools import partial
+import eutils
+import pubmed_xml
+import http_cache
+import airtable_sync
+import tfidf
+import metrics
+import tracing
+from journal import Journal
+from authors import AuthorStore, format_candidates
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 semantic_url = "https://api.semanticscholar.org/graph/v1/paper/search/match?query="
+semantic_batch_url = "https://api.semanticscholar.org/graph/v1/paper/batch"
 header = {"x-api-key": os.getenv('SEMANTIC_SCHOLAR_API_KEY')}
 pubmed_base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
 email = "your-email@example.com"
 
 api = Api(os.getenv('AIRTABLE_API_KEY'))
-reference_info = {}
+#authors found for each paper (an AuthorStore), the only thing kept once a paper is done
 references = {}
 
 table1 = api.table('appvtCMw78DSAMOUH', 'Team1_Preprints')
-session_alex = LimiterSession(
-        per_second=10,
-        per_day=100000
-    )
-session_semantic = LimiterSession(
-        per_second=1
-    )
+#request rates for each API are set in rate_limit.LIMITS and shared across processes
+session_alex = RateLimitedSession()
+session_semantic = RateLimitedSession()
+
+# max number of requests in flight per API host when records are processed concurrently
+HOST_LIMITS = {
+    "api.openalex.org": 5,
+    "api.semanticscholar.org": 1,
+    "eutils.ncbi.nlm.nih.gov": 3,
+}
+host_semaphores = {host: threading.BoundedSemaphore(limit) for host, limit in HOST_LIMITS.items()}
+#all NCBI calls share one pooled keep-alive client, its pool size caps NCBI requests in flight
+#and it stops a PubMed lookup that lost a race the same way send() does (check_cancelled is defined below)
+pubmed_client = eutils.EutilsClient(pool_size=HOST_LIMITS["eutils.ncbi.nlm.nih.gov"],
+                                    before_send=lambda url: check_cancelled(url))
+
+# max number of work IDs OpenAlex accepts in one openalex_id filter
+OPENALEX_BATCH_SIZE = 50
+# max number of concepts OR'd together in one abstract.search filter
+OPENALEX_OR_LIMIT = 50
+# results per page (OpenAlex maximum) and a cap on pages walked per query
+OPENALEX_PAGE_SIZE = 200
+OPENALEX_MAX_PAGES = 25
+# max number of paper IDs Semantic Scholar accepts in one /paper/batch request
+SEMANTIC_BATCH_SIZE = 500
+
+# numeric part of an OpenAlex work link, e.g. https://openalex.org/W2741809807
+WORK_ID_RE = re.compile(r'/W(\d+)$')
+
+# seconds each source gets per record when sources are raced
+SOURCE_DEADLINES = {"openalex": 120, "semantic_scholar": 60, "pubmed": 60}
+DEFAULT_DEADLINE = 60
+# per-thread cancel flag of the race a source thread is running in
+race = threading.local()
 
 COUNT = 0
+count_lock = threading.Lock()
 
 def increment():
     global COUNT
-    COUNT+=1
+    with count_lock:
+        COUNT+=1
+
+
+class SourceCancelled(requests.exceptions.RequestException):
+    #raised in a source's thread once another source has won the race
+    pass
+
+
+def check_cancelled(url):
+    #raise SourceCancelled if this thread runs a source whose race is already over
+    cancelled = getattr(race, "cancelled", None)
+    if cancelled is not None and cancelled.is_set():
+        raise SourceCancelled(f"cancelled before sending {url}")
+
+
+def send(session, url, method="GET", **kwargs):
+    #send a request through the given session (or the requests module) while holding a slot for the host
+    check_cancelled(url)
+    semaphore = host_semaphores.get(urlparse(url).netloc)
+    if semaphore is None:
+        return session.request(method, url, **kwargs)
+    with semaphore:
+        return session.request(method, url, **kwargs)
+
+
+def fetch(session, url, method="GET", **kwargs):
+    #answer from the on-disk response cache if we can, otherwise send the request and cache the response
+    return http_cache.cache.request(url, method=method, send=partial(send, session), **kwargs)
+
+
+def work_number(link):
+    #"https://openalex.org/W2741809807" -> 2741809807, None for anything that isn't a work link
+    match = WORK_ID_RE.search(link or '')
+    return int(match.group(1)) if match else None
+
+
+class PreprintState:
+    #reference state for one preprint, created by process_record and dropped when the preprint is done
+    #so nothing carries over between preprints. works are stored by number, not by full link
+    def __init__(self, paper, record=None, journal=None):
+        self.paper = paper
+        #finished stages are journaled under the Airtable record, if there is a journal
+        self.record = record
+        self.journal = journal
+        #works the preprint cites
+        self.referenced = set()
+        #works already in final_references, keeps the list free of duplicates without scanning it
+        self.matched = set()
+        self.final_references = []
+
+    def add_references(self, links):
+        for link in links:
+            number = work_number(link)
+            if number is not None:
+                self.referenced.add(number)
+
+    def add_match(self, link):
+        #keep a search result if the preprint cites it and we don't have it yet
+        number = work_number(link)
+        if number in self.referenced and number not in self.matched:
+            self.matched.add(number)
+            self.final_references.append(link)
+
+    def load(self, stage):
+        #data of a stage an earlier, interrupted run finished, or None
+        if self.journal is None or self.record is None:
+            return None
+        return self.journal.get(self.record, stage)
+
+    def save(self, stage, data):
+        if self.journal is not None and self.record is not None:
+            self.journal.put(self.record, stage, data)
 
 
-def open_alex_search(paper, concepts, methods, final_reference_list):
+def resolve_openalex_preprint(paper):
+    #find the preprint on OpenAlex, returns its API link and the links of the works it cites, or None if there's no match
     search_url = "https://api.openalex.org/works?filter=title.search:"
-    try:
-        response = session_alex.get(search_url + paper)
+    with tracing.tracer.span("openalex_search"):
+        response = fetch(session_alex, search_url + paper)
         response.raise_for_status()
-        print("successfully searched for paper: ", paper)
+        log.info("successfully searched for paper: %s", paper)
+        results = response.json()['results']
+        if not results:
+            log.warning("No match for paper: %s on OpenAlex", paper)
+            return None
         #raw link to preprint
-        preprint_link = response.json()['results'][0]['id']
-        # Convert preprint link to API URL
-        preprint_link = preprint_link[:8] + 'api.' + preprint_link[8:] 
-        try:
-            response = session_alex.get(preprint_link)
-            response.raise_for_status()
-            #put all the referenced works in a dict
-            reference_table(paper, response)
-            #print(concepts, methods)
-            if not concepts or not methods:
-                print(f"No concepts or methods found for paper {paper}.")
-                return []
-            else:
-                cross_reference(concepts, methods, final_reference_list)
-                update_author_list(paper, final_reference_list)
-                return []
-        except requests.exceptions.HTTPError as e:
-            print(f"An error occurred while fetching paper {paper}: {e}")
-            return []
+        preprint_link = results[0]['id']
+    # Convert preprint link to API URL
+    preprint_link = preprint_link[:8] + 'api.' + preprint_link[8:] 
+    with tracing.tracer.span("reference_table") as span:
+        response = fetch(session_alex, preprint_link)
+        response.raise_for_status()
+        referenced_works = reference_table(paper, response)
+        span["references"] = len(referenced_works)
+    return {"preprint": preprint_link, "referenced_works": referenced_works}
+
+def open_alex_search(paper, concepts, methods, state, match_mode="remote"):
+    #returns the authors of the references that match the preprint's concepts and methods
+    try:
+        #every finished step is journaled, a resumed run picks up after the last one
+        resolved = state.load("openalex_references")
+        if resolved is None:
+            resolved = resolve_openalex_preprint(paper)
+            if resolved is None:
+                return AuthorStore()
+            state.save("openalex_references", resolved)
+        #keep the numbers of all the referenced works
+        state.add_references(resolved["referenced_works"])
+        #print(concepts, methods)
+        if not concepts or not methods:
+            log.warning("No concepts or methods found for paper %s.", paper)
+            return AuthorStore()
+        matches = state.load(f"openalex_matches_{match_mode}")
+        if matches is not None:
+            for link in matches:
+                state.add_match(link)
+        else:
+            with tracing.tracer.span("cross_reference", mode=match_mode, references=len(state.referenced)) as span:
+                if match_mode == "local":
+                    local_cross_reference(concepts, methods, state, resolved["referenced_works"])
+                elif match_mode == "tfidf":
+                    tfidf_cross_reference(concepts, methods, state, resolved["referenced_works"])
+                else:
+                    cross_reference(concepts, methods, state, resolved["preprint"].rsplit('/', 1)[-1])
+                span["matches"] = len(state.final_references)
+            state.save(f"openalex_matches_{match_mode}", state.final_references)
+        with tracing.tracer.span("author_resolution", references=len(state.final_references)) as span:
+            authors = update_author_list(paper, state.final_references)
+            span["authors"] = len(authors)
+        return authors
     except requests.exceptions.HTTPError as e:
-        print(f"An error occurred while fetching paper {paper}: {e}")
-        return []
+        log.error("An error occurred while fetching paper %s: %s", paper, e)
+        return AuthorStore(failed=True)
 
 def search_semantic(paper):
+    #returns the authors of all the preprint's references on semantic scholar
+    authors = AuthorStore()
     try:
-        response = session_semantic.get(semantic_url + paper, headers=header)
-        time.sleep(2)
+        response = fetch(session_semantic, semantic_url + paper, headers=header)
         response.raise_for_status()
-        print(f"successfully fetched paper: {paper} from semantic scholar")
+        log.info("successfully fetched paper: %s from semantic scholar", paper)
         # get paper ID for first paper returned from search. Then use the paperID to get references of paper
-        paperid = response.json()['data'][0]['paperId']
+        data = response.json().get('data')
+        if not data:
+            log.warning("No match for paper: %s in semantic scholar", paper)
+            return authors
+        paperid = data[0]['paperId']
         url = f"https://api.semanticscholar.org/graph/v1/paper/{paperid}?fields=references"
         try:
-            response = session_semantic.get(url, headers=header)
-            time.sleep(2)
+            response = fetch(session_semantic, url, headers=header)
             response.raise_for_status()
             semantic_references = response.json()['references']
             if not semantic_references:
-                print(f"No references found for paper: {paper} in semantic scholar")
-                return
-            references.update({paper: {"authors": []}})
-            for reference in semantic_references:
-                paperid = reference['paperId']
-                url = f"https://api.semanticscholar.org/graph/v1/paper/{paperid}?fields=authors"
-                response = session_semantic.get(url, headers=header)
-                time.sleep(2)
+                log.warning("No references found for paper: %s in semantic scholar", paper)
+                return authors
+            #get authors for all references through the batch endpoint, references without a paperId can't be looked up
+            paperids = [reference['paperId'] for reference in semantic_references if reference.get('paperId')]
+            for i in range(0, len(paperids), SEMANTIC_BATCH_SIZE):
+                response = fetch(session_semantic, semantic_batch_url, method="POST", params={"fields": "authors"},
+                                 json={"ids": paperids[i:i + SEMANTIC_BATCH_SIZE]}, headers=header)
                 try:
                     response.raise_for_status()
                 except requests.exceptions.HTTPError as e:
-                    print(f"An error occurred while fetching authors for {paper}: {e}")
+                    log.error("An error occurred while fetching authors for %s: %s", paper, e)
+                    authors.failed = True
                     continue
-                new_references = response.json()['authors']
-                for author in new_references:
-                   references[paper]["authors"].append({author['name'], author['authorId']})
-            print(f"successfully fetched referenced paper for: {paper} from semantic scholar")
-            return
+                #results come back in the same order as the ids, with null for papers S2 doesn't know
+                for reference in response.json():
+                    if reference is None:
+                        continue
+                    for author in reference['authors']:
+                        authors.add(reference.get('paperId'), author['name'], s2_id=author['authorId'])
+            log.info("successfully fetched referenced paper for: %s from semantic scholar", paper)
+            return authors
         except requests.exceptions.HTTPError as e:
-            print(f"An error occurred while fetching references for {paper}: {e}") 
-            return
+            log.error("An error occurred while fetching references for %s: %s", paper, e)
+            authors.failed = True
+            return authors
     except requests.exceptions.HTTPError as e:
-        print(f"An error occurred while fetching paper {paper}: {e}")
-        return
+        log.error("An error occurred while fetching paper %s: %s", paper, e)
+        authors.failed = True
+        return authors
     
     
 def split_concepts_and_methods(concepts_methods):
     if not concepts_methods:
-        print("Concepts and Methods not found in the string.")
+        log.warning("Concepts and Methods not found in the string.")
         return [], []
     else:
         pos = concepts_methods.find('Methods:')
@@ -118,62 +274,151 @@ def split_concepts_and_methods(concepts_methods):
 
 def reference_table(paper, response):
     if response.json()['referenced_works_count'] == 0:
-        print(f"No references found for paper: {paper}.")
-        return
-    #set up dict structure
-    for reference in response.json()['referenced_works']:
-        reference_info.update({reference: 1})
+        log.warning("No references found for paper: %s.", paper)
+        return []
+    return response.json()['referenced_works']
 
 
-def check_reference(response, final_reference_list):
+def check_reference(response, state):
     #cross check if reference from filtered search is in the original list of references
     if response.json()['meta']['count'] == 0:
-        print(f"No references found for this paper through Open Alex.")
+        log.warning("No references found for this paper through Open Alex.")
         return
     #print(response.json()['results'][0]['id'])
     for result in response.json()['results']:
-        result = result['id']
-        #print(reference_info[result])
-        if reference_info.get(result) != None:
-            final_reference_list.append(result)
+        state.add_match(result['id'])
     
 
-def cross_reference(concepts, methods, final_reference_list):
-    extension = 'fulltext.search:'
+def cross_reference(concepts, methods, state, preprint_id=None):
     #chain together all the methods with OR operation
-    for method in methods:
-        extension += f"{method}|"
-    extension = extension.rstrip('|')  
-    #make call for each concept and use the same methods for all concepts
-    for concept in concepts:
-        url = f"https://api.openalex.org/works?filter=abstract.search:{concept},"
-        url = url+extension 
-        response = session_alex.get(url)
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"An error occurred while fetching papers for concept {concept}: {e}")
-            sys.exit(1)
-        check_reference(response, final_reference_list)
+    extension = 'fulltext.search:' + '|'.join(methods)
+    #limit the search to works the preprint cites so every matching reference fits in a few pages
+    if preprint_id:
+        extension += f",cited_by:{preprint_id}"
+    #OR the concepts together as well, OPENALEX_OR_LIMIT concepts per request
+    for i in range(0, len(concepts), OPENALEX_OR_LIMIT):
+        chunk = concepts[i:i + OPENALEX_OR_LIMIT]
+        url = (f"https://api.openalex.org/works?filter=abstract.search:{'|'.join(chunk)},{extension}"
+               f"&select=id&per_page={OPENALEX_PAGE_SIZE}")
+        #walk every page of results with cursor pagination
+        cursor = '*'
+        pages = 0
+        while cursor and pages < OPENALEX_MAX_PAGES:
+            #cursors are base64 and may contain + / =, params gets them URL-encoded
+            response = fetch(session_alex, url, params={"cursor": cursor})
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                log.error("An error occurred while fetching papers for concepts %s: %s", ", ".join(chunk), e)
+                raise
+            check_reference(response, state)
+            cursor = response.json()['meta'].get('next_cursor')
+            pages += 1
         #print(url)
 
-def update_author_list(paper, final_reference_list):
-    #for each reference link in final_reference_list, convert each link to API URL and then get authors and orcid of each paper
-    references.update({paper: {"authors": []}})
+def abstract_from_inverted_index(inverted_index):
+    #OpenAlex ships abstracts as {word: [positions]}, put the words back in order
+    if not inverted_index:
+        return ""
+    words = {}
+    for word, positions in inverted_index.items():
+        for position in positions:
+            words[position] = word
+    return " ".join(words[position] for position in sorted(words))
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+def fetch_works(work_links, select):
+    #fetch the select fields of many works per request with the pipe-joined openalex_id filter
+    #returns {work link: work}, select must include id
+    works = {}
+    work_ids = list(dict.fromkeys(link.rsplit('/', 1)[-1] for link in work_links))
+    for i in range(0, len(work_ids), OPENALEX_BATCH_SIZE):
+        chunk = work_ids[i:i + OPENALEX_BATCH_SIZE]
+        url = (f"https://api.openalex.org/works?filter=openalex_id:{'|'.join(chunk)}"
+               f"&select={select}&per_page={OPENALEX_BATCH_SIZE}")
+        response = fetch(session_alex, url)
+        response.raise_for_status()
+        for work in response.json()['results']:
+            works[work['id']] = work
+    return works
+
+def get_reference_texts(work_links):
+    #title, abstract and topics of the works
+    #returns {work link: (title and abstract, title abstract and topic names)}, all lowercased
+    texts = {}
+    for link, work in fetch_works(work_links, "id,title,abstract_inverted_index,topics").items():
+        abstract = normalize_text(f"{work.get('title') or ''} {abstract_from_inverted_index(work.get('abstract_inverted_index'))}")
+        topics = normalize_text(" ".join(topic['display_name'] for topic in work.get('topics') or []))
+        texts[link] = (abstract, f"{abstract} {topics}")
+    return texts
+
+def local_cross_reference(concepts, methods, state, reference_links):
+    #same question as cross_reference, answered against the preprint's own references instead of a corpus-wide search:
+    #a reference matches if its title/abstract mentions a concept and its title/abstract/topics mention a method
+    concepts = [normalize_text(concept) for concept in concepts if concept.strip()]
+    methods = [normalize_text(method) for method in methods if method.strip()]
+    try:
+        texts = get_reference_texts(reference_links)
+    except requests.exceptions.HTTPError as e:
+        log.error("An error occurred while fetching referenced works: %s", e)
+        raise
+    for reference in reference_links:
+        if reference not in texts:
+            continue
+        abstract, full_text = texts[reference]
+        if any(concept in abstract for concept in concepts) and any(method in full_text for method in methods):
+            state.add_match(reference)
+    if not state.final_references:
+        log.warning("No references found for this paper through Open Alex.")
 
+def tfidf_cross_reference(concepts, methods, state, reference_links, min_score=tfidf.MIN_SCORE):
+    #graded version of local_cross_reference: score the referenced works' titles, abstracts and topics
+    #against the preprint's concepts and methods by TF-IDF cosine similarity, keep those scoring at least min_score, best first
+    try:
+        texts = get_reference_texts(reference_links)
+    except requests.exceptions.HTTPError as e:
+        log.error("An error occurred while fetching referenced works: %s", e)
+        raise
+    query = " ; ".join(concepts + methods)
+    scores = tfidf.score_batch({state.paper: (query, {reference: texts[reference][1] for reference in texts})})[state.paper]
+    for reference, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+        if score >= min_score:
+            state.add_match(reference)
+    if not state.final_references:
+        log.warning("No references found for this paper through Open Alex.")
+
+def get_authorships(work_links):
+    #returns {work link: authorships}
+    return {link: work['authorships'] for link, work in fetch_works(work_links, "id,authorships").items()}
+
+def update_author_list(paper, final_reference_list):
+    #get authors and orcid of each paper in final_reference_list, OPENALEX_BATCH_SIZE papers per request
+    authors = AuthorStore()
+    try:
+        authorships = get_authorships(final_reference_list)
+    except requests.exceptions.HTTPError as e:
+        log.error("An error occurred while fetching authors for paper %s: %s", paper, e)
+        raise
     for reference in final_reference_list:
-        preprint_link = reference[:8] + 'api.' + reference[8:] 
-        response = session_alex.get(preprint_link)
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"An error occurred while fetching paper {paper}: {e}")
-            sys.exit(1)
-        authors = response.json()['authorships']
-        for author in authors:
-            references[paper]["authors"].append({author['author']['display_name'], author['author']['orcid']})
+        if reference not in authorships:
+            log.debug("No authorships returned for reference %s.", reference)
+            continue
+        for authorship in authorships[reference]:
+            author = authorship['author']
+            institutions = authorship.get('institutions') or []
+            affiliation = institutions[0].get('display_name') if institutions else None
+            authors.add(reference, author['display_name'], orcid=author.get('orcid'),
+                        openalex_id=author.get('id'), affiliation=affiliation)
+    return authors
 
 def preprint_id_pubmed(paper, doi):
+    #PMID of the preprint, None if PubMed doesn't have it, raises requests.RequestException if a request fails
+    #the title search is only trusted when the preprint's DOI confirms it, so there's nothing to do without one
+    if not doi:
+        log.warning("No DOI for paper: %s, skipping the PubMed search.", paper)
+        return None
     search_url = f"{pubmed_base_url}/esearch.fcgi"
     params = {
          "db": "pubmed",
@@ -183,8 +428,7 @@ def preprint_id_pubmed(paper, doi):
          "email": email
      }
     try:
-        response = requests.get(search_url, params=params)
-        time.sleep(2)
+        response = pubmed_client.request(search_url, params=params)
         response.raise_for_status()
         root = ET.fromstring(response.content)
         pmids = []
@@ -202,23 +446,18 @@ def preprint_id_pubmed(paper, doi):
             "retmax": 10,
             "email": email
         }
-        try:
-            response = requests.get(search_url, params=params)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)
-            for pmid_elem in root.findall(".//Id"):
-                if pmid_elem.text in pmids:
-                    return pmid_elem.text
-        except requests.RequestException as e:
-            print(f"Error searching PubMed for DOI: {e}")
-            return None
-
+        response = pubmed_client.request(search_url, params=params)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        for pmid_elem in root.findall(".//Id"):
+            if pmid_elem.text in pmids:
+                return pmid_elem.text
     except requests.RequestException as e:
-
-        print(f"Error searching PubMed: {e}")
-        return []
+        log.error("Error searching PubMed for paper %s: %s", paper, e)
+        raise
 
 def get_pubmed_references(id):
+    #PMIDs the article cites, None if there's no such article, raises requests.RequestException if the request fails
     fetch_url = f"{pubmed_base_url}/efetch.fcgi"
     params = {
         "db": "pubmed", 
@@ -226,109 +465,280 @@ def get_pubmed_references(id):
         "retmode": "xml", 
         "email": email
         }
-    references = []
-
     try:
-        response = requests.get(fetch_url, params=params)
+        response = pubmed_client.request(fetch_url, params=params)
         response.raise_for_status()
-        root = ET.fromstring(response.content)
-        article = root.find(".//PubmedArticle")
+        article = next(pubmed_xml.iter_articles(response.content), None)
         if article is None:
             return None
-        reference_list = article.find(".//ReferenceList")
-        if reference_list is not None:
-            for ref in reference_list.findall(".//Reference"):
-                ref_info = {}
-                # Article IDs in references (PMID, DOI, etc.)
-                article_ids = ref.findall(".//ArticleId")
-                for aid in article_ids:
-                    id_type = aid.get("IdType") 
-                    #print(id_type)
-                    if id_type == "pubmed" and aid.text:
-                        references.append(aid.text)
+        # PMIDs of the references that have one
+        references = [ref["pubmed"] for ref in article["references"] if "pubmed" in ref]
         return references
     except requests.RequestException as e:
-        print(f"Error fetching references for ID {id}: {e}")
-        return None
+        log.error("Error fetching references for ID %s: %s", id, e)
+        raise
 
 def update_author_pubmed(reference_codes, paper):
-    fetch_url = f"{pubmed_base_url}/efetch.fcgi"
-    references.update({paper: {"authors": []}})
+    authors = AuthorStore()
     if not reference_codes:
-        print(f"No references found for paper: {paper}.")
-        return
+        log.warning("No references found for paper: %s.", paper)
+        return authors
+    log.info("fetching authors for %d references", len(reference_codes))
+    try:
+        articles = pubmed_client.fetch_articles(reference_codes)
+    except requests.RequestException as e:
+        log.error("Error fetching references for %s: %s", paper, e)
+        authors.failed = True
+        return authors
     for ref in reference_codes:
-        params = { 
-            "db": "pubmed", 
-            "id": ref, 
-            "retmode": "xml", 
-            "email": email
-            }
+        article = articles.get(ref)
+        if article is None:
+            log.debug("No article found for ID %s.", ref)
+            continue
+        for first_name, last_name, affiliation in article["authors"]:
+            name = pubmed_xml.author_name(first_name, last_name)
+            if name is not None:
+                authors.add(ref, name, affiliation=affiliation)
+        log.debug("Successfully fetched authors for reference: %s", ref)
+    return authors
+
+def search_pubmed(paper, doi, state):
+    '''Get authors from PubMed, doesn't use extensive filtering. More advanced methods in pubtest.py'''
+    pubmed = state.load("pubmed_references")
+    if pubmed is None:
         try:
-            response = requests.get(fetch_url, params=params)
-            print("fetching authors for reference: ", ref)
-            time.sleep(2)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)
-            article = root.find(".//PubmedArticle")
-            if article is None:
-                print(f"No article found for ID {ref}.")
-                return None
-            author_list = article.find(".//AuthorList")
-            if author_list is not None:
-                for author in author_list.findall(".//Author"):
-                    first_name = author.find(".//ForeName")
-                    #print(first_name.text)
-                    last_name = author.find(".//LastName")
-                    #print(last_name.text)
-                    affiliation = author.find(".//AffiliationInfo/Affiliation")
-                    #print(affiliation.text)
-                    references[paper]["authors"].append({f"{first_name.text} {last_name.text}", affiliation.text if affiliation is not None else "No Affiliation"})
-                    print("Successfully fetched authors for reference: ", ref)
-                    
-        except requests.RequestException as e:
-            print(f"Error fetching references for ID {id}: {e}")
-            return None
-    return references
-
-def main():
-    records = table1.all(view='Proposals')
-    records_to_update = [
-        record for record in records
-        if (record['fields'].get('Status') == 'To Pitch(Editorial)'
-            or record['fields'].get('Status') == 'Selected')
-        and (record['fields'].get('Updated Concepts'))
-            # or record['fields'].get('Updated Concepts').strip() == '')
-    ]
-    for record in records_to_update[0:10]:
-        final_reference_list = []
-        fields = record['fields']
+            with tracing.tracer.span("pubmed_id") as span:
+                id = preprint_id_pubmed(paper, doi)
+                span["pmid"] = id
+            with tracing.tracer.span("pubmed_references") as span:
+                pubmed = {"pmid": id, "references": get_pubmed_references(id) if id else None}
+                span["references"] = len(pubmed["references"] or [])
+        except requests.RequestException:
+            #lookups that failed are not journaled so a resumed run tries them again
+            return AuthorStore(failed=True)
+        state.save("pubmed_references", pubmed)
+    with tracing.tracer.span("pubmed_authors", references=len(pubmed["references"] or [])) as span:
+        authors = update_author_pubmed(pubmed["references"], paper)
+        span["authors"] = len(authors)
+    return authors
+
+def traced_lookup(source, lookup, record=None):
+    #run one source's lookup inside a span named after the source, record is passed in when it runs on a race thread
+    with tracing.tracer.span(source, record=record) as span:
+        authors = lookup()
+        span["authors"] = len(authors)
+        span["failed"] = authors.failed
+        return authors
+
+def run_source(lookup, cancelled):
+    #run one source's lookup in a race thread, send() checks cancelled before every request
+    race.cancelled = cancelled
+    try:
+        return lookup()
+    finally:
+        race.cancelled = None
+
+def race_sources(paper, lookups, policy="first", deadlines=SOURCE_DEADLINES):
+    #query every source at once, lookups is {source: function returning an AuthorStore}
+    #policy "first": the first source with authors wins and the others are cancelled
+    #policy "merge": wait for every source (up to its deadline) and merge their authors
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(lookups))
+    start = time.monotonic()
+    record = tracing.tracer.current_record()
+    futures = {executor.submit(run_source, partial(traced_lookup, source, lookup, record), cancelled): source
+               for source, lookup in lookups.items()}
+    pending = set(futures)
+    results = {}
+    #sources that raised or missed their deadline
+    errors = set()
+    try:
+        while pending:
+            now = time.monotonic()
+            for future in list(pending):
+                if now - start >= deadlines.get(futures[future], DEFAULT_DEADLINE):
+                    log.warning("%s missed its deadline for paper: %s", futures[future], paper)
+                    errors.add(futures[future])
+                    pending.discard(future)
+            if not pending:
+                break
+            timeout = min(start + deadlines.get(futures[future], DEFAULT_DEADLINE) for future in pending) - now
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                source = futures[future]
+                try:
+                    results[source] = future.result()
+                except Exception as e:
+                    #whatever goes wrong in a source only takes that source out of the race
+                    log.warning("%s failed for paper: %s: %r", source, paper, e)
+                    errors.add(source)
+            if policy == "first" and any(len(authors) for authors in results.values()):
+                break
+    finally:
+        #losers stop at their next request, sources that haven't started never do
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    #without a winner (or in a merge) any source that failed may have held authors
+    authors = AuthorStore(failed=bool(errors) or any(result.failed for result in results.values()))
+    #results in lookup order so a merge lists the preferred source's authors first
+    for source in lookups:
+        if source in results and len(results[source]):
+            if policy == "first":
+                log.info("Using %s authors for paper: %s", source, paper)
+                return results[source]
+            authors.merge(results[source])
+    return authors
+
+def process_record(record, match_mode="remote", journal=None, source_policy="fallback"):
+    fields = record['fields']
+    with tracing.tracer.span("clean_title") as span:
         paper = fields.get('Title').replace(',', ' ')
         #remove any bracketed text from title
         paper = re.sub(r'\[.*?\]', '', paper).strip()
         #print(record)
         doi = fields.get('Link/DOI')
-        print(doi)
+        log.debug("DOI: %s", doi)
         concepts_methods=fields.get('Updated Concepts')
         #extract concepts and methods from string and split into two lists
         concepts,methods = split_concepts_and_methods(concepts_methods)
-        open_alex_search(paper, concepts, methods, final_reference_list)
-        if len(references[paper]["authors"]) == 0:
-            print(f"Open Alex did not work for paper: {paper}. Trying Semantic Scholar.")
-            search_semantic(paper)
-        if len(references[paper]["authors"]) == 0:
-            '''Get authors from PubMed, doesn't use extensive filtering. More advanced methods in pubtest.py'''
-            print(f"Semantic Scholar did not work for paper: {paper}. Trying PubMed.")
-            id = preprint_id_pubmed(paper, doi)
-            pubmed_references = get_pubmed_references(id)
-            update_author_pubmed(pubmed_references, paper)
-        if len(references[paper]["authors"]) == 0:
-            print(f"No authors found for paper: {paper} from any API.")
+        span.update(concepts=len(concepts), methods=len(methods))
+    #goes out of scope when this record is done, only the authors in references are kept
+    state = PreprintState(paper, record, journal)
+    authors = state.load("authors")
+    if authors is not None:
+        log.info("Resuming paper: %s from the journal.", paper)
+        references[paper] = {"authors": AuthorStore.from_list(authors)}
+    else:
+        lookups = {
+            "openalex": partial(open_alex_search, paper, concepts, methods, state, match_mode),
+            "semantic_scholar": partial(search_semantic, paper),
+            "pubmed": partial(search_pubmed, paper, doi, state),
+        }
+        if source_policy == "fallback":
+            #one source after the other, stopping at the first that finds authors
+            failed = False
+            for source, lookup in lookups.items():
+                authors = traced_lookup(source, lookup)
+                failed = failed or authors.failed
+                if len(authors) > 0:
+                    break
+                log.info("%s did not work for paper: %s.", source, paper)
+            #a preferred source that errored might have answered differently
+            authors.failed = failed
         else:
-            increment()
+            authors = race_sources(paper, lookups, source_policy)
+        references[paper] = {"authors": authors}
+        if len(authors) > 0 and not authors.failed:
+            state.save("authors", authors.to_list())
+    if len(references[paper]["authors"]) == 0:
+        log.warning("No authors found for paper: %s from any API.", paper)
+    else:
+        increment()
+    return paper
+
+def process_safely(record, match_mode="remote", journal=None, source_policy="fallback", profile_dir=None):
+    #a failed record doesn't end the run, it is left out of the checkpoint and retried next time
+    #every stage of the record is traced under its record ID, and profiled if there is a profile_dir
+    try:
+        with tracing.profile(record['id'], profile_dir), tracing.tracer.span("record", record=record['id']):
+            return process_record(record, match_mode, journal, source_policy)
+    except requests.exceptions.RequestException as e:
+        log.error("Giving up on record %s for this run: %s", record['id'], e)
+        return None
+
+def main(workers=1, match_mode="remote", incremental=True, write_field=None, source_policy="fallback", trace=None, profile_dir=None,
+         limit=10):
+    #spans are only kept when they will be written to a trace file
+    tracing.tracer.enabled = bool(trace)
+    #only records that are new or changed since the last run, unless incremental is off
+    checkpoint = airtable_sync.Checkpoint('referee_finder') if incremental else None
+    with tracing.tracer.span("airtable_read") as span:
+        records_to_update = list(airtable_sync.pending_records(table1, checkpoint))
+        span["records"] = len(records_to_update)
+    #at most limit records per run (None or 0 for all of them), the rest stay pending for the next run
+    batch = records_to_update[:limit] if limit else records_to_update
+    #stages finished by an interrupted run are picked up from the journal instead of being fetched again
+    journal = Journal('referee_finder')
+    if journal.resumed():
+        log.info("Resuming %d records from %s", journal.resumed(), journal.path)
+    #ranked candidates are written back in the background while later records are processed
+    writer = airtable_sync.RecordWriter(table1, write_field) if write_field else None
+    if workers <= 1:
+        papers = (process_safely(record, match_mode, journal, source_policy, profile_dir) for record in batch)
+        executor = None
+    else:
+        #process records in parallel, fetch() keeps each API host within HOST_LIMITS
+        executor = ThreadPoolExecutor(max_workers=workers)
+        papers = executor.map(partial(process_safely, match_mode=match_mode, journal=journal, source_policy=source_policy,
+                                      profile_dir=profile_dir), batch)
+    done = []
+    failed = 0
+    for record, paper in zip(batch, papers):
+        if paper is None:
+            failed += 1
+            continue
+        done.append(paper)
+        if references[paper]["authors"].failed:
+            #a source errored, so the candidates may be incomplete: nothing is written and the record is retried next run
+            failed += 1
+            continue
+        #no candidates writes nothing, an empty string with typecast would erase what the field already holds
+        if writer and len(references[paper]["authors"]) > 0:
+            writer.put(record['id'], format_candidates(references[paper]["authors"]))
+        if checkpoint:
+            checkpoint.mark(record)
+    if executor:
+        executor.shutdown()
+    #workers finish in any order, put results back in record order so output matches a sequential run
+    ordered = {paper: references[paper] for paper in done if paper in references}
+    references.clear()
+    references.update(ordered)
+    if writer:
+        failed_writes = writer.close()
+        log.info("Wrote candidates for %d records to '%s', %d failed.", writer.written, write_field, len(failed_writes))
+        if checkpoint:
+            #records whose write failed are processed and written again next run
+            for record_id in failed_writes:
+                checkpoint.unmark(record_id)
+    if checkpoint:
+        checkpoint.save()
+    #nothing left to resume once every record got through
+    if failed:
+        log.warning("%d records failed, their finished stages are kept in %s", failed, journal.path)
+    else:
+        journal.clear()
     print(references)
-    print(f"Found {COUNT} out of {len(records_to_update[0:10])} papers with references.")
+    print(f"Found {COUNT} out of {len(batch)} papers with references.")
+    print(http_cache.cache.summary())
+    metrics.registry.export("referee_finder")
+    print(metrics.registry.report())
+    if trace:
+        tracing.tracer.export(trace)
+        print(tracing.tracer.report())
+        print(f"Trace written to {trace}, open it in chrome://tracing or ui.perfetto.dev")
     
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Find potential referees for preprints in the Airtable 'Proposals' view.")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of records to process concurrently (default: 1)")
+    parser.add_argument("--match", choices=["remote", "local", "tfidf"], default="remote",
+                        help="remote: OpenAlex full-text search per preprint, local: match concepts and methods against the referenced works' titles, abstracts and topics, "
+                             "tfidf: same texts ranked by TF-IDF cosine similarity (default: remote)")
+    parser.add_argument("--all", action="store_true", help="Process every matching record, not only those new or changed since the last run")
+    parser.add_argument("--write-field", default=os.getenv('REFEREE_OUTPUT_FIELD'),
+                        help="Airtable field to write each record's ranked referee candidates to (default: $REFEREE_OUTPUT_FIELD, unset means results are only printed)")
+    parser.add_argument("--sources", choices=["fallback", "first", "merge"], default="fallback",
+                        help="fallback: OpenAlex, then Semantic Scholar, then PubMed, each only if the previous found no authors; "
+                             "first: query all three at once and keep the first with authors; merge: query all three at once and merge their authors (default: fallback)")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING or ERROR (default: $REFEREE_LOG_LEVEL or INFO)")
+    parser.add_argument("--trace", metavar="FILE", default=os.getenv('REFEREE_TRACE'),
+                        help="Write a timeline of every record's stages to FILE in Chrome trace JSON format (default: $REFEREE_TRACE, unset means no trace)")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="Run each record under cProfile and write the stats to DIR/<record id>.prof")
+    parser.add_argument("--limit", type=int, default=10,
+                        help="Process at most this many records per run, 0 for no limit (default: %(default)s)")
+    args = parser.parse_args()
+    metrics.setup_logging(args.log_level)
+    main(workers=args.workers, match_mode=args.match, incremental=not args.all, write_field=args.write_field,
+         source_policy=args.sources, trace=args.trace, profile_dir=args.profile, limit=args.limit)
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+
+Local lexical relevance scoring for reference abstracts.
+Builds a positional inverted index over the titles and abstracts of a preprint's references
+and ranks them with BM25 against the preprint's methods. Multi-word methods are matched as
+phrases, and words are lightly stemmed so "sequences" and "sequencing" meet at "sequenc".
+prefilter() uses word and word-pair overlap to decide the clear cases before anything is
+sent to an LLM.
+"""
+import math
+import re
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+    "of", "on", "or", "that", "the", "their", "this", "to", "was", "were", "with",
+}
+# Checked in order, a suffix is only stripped if at least 3 characters remain
+SUFFIXES = (
+    "ational", "ization", "fulness", "iveness", "ations", "ation", "ments", "ment", "ness",
+    "ings", "ing", "ated", "ates", "ate", "ies", "ied", "ers", "er", "ed", "ly", "es", "is", "s", "e",
+)
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """
+    Strip one common English suffix. Cheap and good enough to line up plurals and verb forms.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix in ("ies", "ied"):
+                return word[:-3] + "y"
+            if suffix == "s" and word.endswith("ss"):
+                return word
+            word = word[:-len(suffix)]
+            # modelling -> model, planned -> plan
+            if suffix in ("ing", "ings", "ed") and word[-1] == word[-2] and word[-1] not in "aeiousz":
+                word = word[:-1]
+            return word
+    return word
+
+
+def analyze(text):
+    """
+    Turn text into (position, stem) pairs. Stopwords are dropped but still take up a position,
+    so phrases only match words that really are next to each other.
+    """
+    terms = []
+    for position, token in enumerate(TOKEN_RE.findall((text or "").lower())):
+        if token not in STOPWORDS:
+            terms.append((position, stem(token)))
+    return terms
+
+# A method whose words and word pairs are all in a reference counts as a clear match,
+# a reference sharing no word with any method is clearly irrelevant
+MATCH_THRESHOLD = 1.0
+REJECT_THRESHOLD = 0.0
+
+
+def ngrams(text):
+    """
+    Set of stems and of pairs of consecutive stems (stopwords skipped) in a text.
+    """
+    stems = [term for position, term in analyze(text)]
+    return set(stems) | set(zip(stems, stems[1:]))
+
+
+def overlap(text_grams, method):
+    """
+    Share of a method's stems and stem pairs found in a text's ngrams(), from 0 to 1.
+    """
+    method_grams = ngrams(method)
+    if not method_grams:
+        return 0.0
+    return len(method_grams & text_grams) / len(method_grams)
+
+
+def prefilter(texts, methods, match_threshold=MATCH_THRESHOLD, reject_threshold=REJECT_THRESHOLD):
+    """
+    Sort references into clear cases and ambiguous ones. texts is {ref: text}.
+    Returns ({ref: methods} for references decided locally, [refs] left for the LLM):
+    a reference with a method at or above match_threshold gets those methods, one where no method
+    gets above reject_threshold (or with no text) gets an empty list, anything else is ambiguous.
+    """
+    decided = {}
+    ambiguous = []
+    for ref, text in texts.items():
+        text_grams = ngrams(text)
+        scores = {method: overlap(text_grams, method) for method in methods}
+        matched = [method for method, score in scores.items() if score >= match_threshold]
+        if matched:
+            decided[ref] = matched
+        elif not text_grams or max(scores.values(), default=0) <= reject_threshold:
+            decided[ref] = []
+        else:
+            ambiguous.append(ref)
+    return decided, ambiguous
+
+
+class BM25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        """
+        documents is a dict of {doc_id: text}.
+        """
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: [positions]}
+        self.postings = {}
+        self.lengths = {}
+        for doc_id, text in documents.items():
+            terms = analyze(text)
+            self.lengths[doc_id] = len(terms)
+            for position, term in terms:
+                self.postings.setdefault(term, {}).setdefault(doc_id, []).append(position)
+        self.avg_length = sum(self.lengths.values()) / len(self.lengths) if self.lengths else 0
+
+    def _phrase_frequencies(self, query):
+        """
+        {doc_id: number of times the query occurs}, with every query word at its offset in the phrase.
+        """
+        terms = analyze(query)
+        if not terms:
+            return {}
+        first_position = terms[0][0]
+        postings = []
+        for position, term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                return {}
+            postings.append((position - first_position, docs))
+        # Start from the rarest word so we check as few documents as possible
+        postings.sort(key=lambda item: len(item[1]))
+        frequencies = {}
+        offset, docs = postings[0]
+        for doc_id, positions in docs.items():
+            count = 0
+            for position in positions:
+                start = position - offset
+                if all(start + other_offset in other_docs.get(doc_id, ()) for other_offset, other_docs in postings[1:]):
+                    count += 1
+            if count:
+                frequencies[doc_id] = count
+        return frequencies
+
+    def score(self, query):
+        """
+        BM25 score of every document that contains the query. Returns {doc_id: score}.
+        """
+        frequencies = self._phrase_frequencies(query)
+        if not frequencies:
+            return {}
+        n = len(self.lengths)
+        df = len(frequencies)
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        scores = {}
+        for doc_id, tf in frequencies.items():
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / (self.avg_length or 1))
+            scores[doc_id] = idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def rank(self, queries, top_k=None):
+        """
+        Rank documents against a list of queries (e.g. the preprint's methods).
+        Returns [(doc_id, total score, [queries that matched])] best first, only documents matching at least one query.
+        """
+        totals = {}
+        matched = {}
+        for query in queries:
+            for doc_id, score in self.score(query).items():
+                totals[doc_id] = totals.get(doc_id, 0) + score
+                matched.setdefault(doc_id, []).append(query)
+        ranking = sorted(totals, key=totals.get, reverse=True)
+        if top_k is not None:
+            ranking = ranking[:top_k]
+        return [(doc_id, totals[doc_id], matched[doc_id]) for doc_id in ranking]
@@ -1,12 +1,14 @@
 import requests
-from requests_ratelimiter import LimiterSession
+from rate_limit import RateLimitedSession
 import sys
 import os
 from dotenv import load_dotenv, dotenv_values
-import time
 load_dotenv()
 
 search_url = "https://api.semanticscholar.org/graph/v1/paper/search/match?query="
+batch_url = "https://api.semanticscholar.org/graph/v1/paper/batch"
+# max number of paper IDs accepted by one /paper/batch request
+batch_size = 500
 #test list of preprints
 papers = ["Campus-based genomic surveillance uncovers early emergence of a future dominant A(H3N2) influenza clade", "Post-sampling degradation of viral RNA in wastewater impacts the quality of PCR-based concentration estimates", "Emetine dihydrochloride inhibits Chikungunya virus nsP2 helicase and shows antiviral activity in the cell culture and mouse model of virus infection", "Diagnostic Accuracy of Swab-Based Molecular Tests for Tuberculosis Using Novel Near-Point-Of-Care Platforms: A Multi-Country Evaluation", "Neutralisation and Antibody-Dependent Cellular Cytotoxicity Functions Map to Distinct SARS-CoV-2 Spike Subdomains and Vaccine Platforms"]
 
@@ -14,28 +16,26 @@ papers = ["Campus-based genomic surveillance uncovers early emergence of a futur
 # {'paper title' : {authors: [{'author name', 'author id'}]}}
 reference_info = {}
 header = {"x-api-key": os.getenv('SEMANTIC_SCHOLAR_API_KEY')}
-session_semantic = LimiterSession(
-        per_second=1
-    )
+session_semantic = RateLimitedSession()
 def update_references(response, paper):
     reference_info.update({paper: {"authors": []}})
     print(f"successfully fetched referenced paper for: {paper}")
     references = response.json()['references']
-    for reference in references:
-        print(reference)
-        #if reference['paperId'] != None:
-        paperid = reference['paperId']
-        url = f"https://api.semanticscholar.org/graph/v1/paper/{paperid}?fields=authors"
-        response = session_semantic.get(url)
+    # look up authors of all references at once, references without a paperId can't be looked up
+    paperids = [reference['paperId'] for reference in references if reference.get('paperId')]
+    for i in range(0, len(paperids), batch_size):
+        response = session_semantic.post(batch_url, params={"fields": "authors"}, json={"ids": paperids[i:i + batch_size]})
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             print(f"An error occurred while fetching authors for {paper}: {e}")
             return
-        references = response.json()['authors']
-        time.sleep(2)  
-        for author in references:
-           reference_info[paper]["authors"].append({author['name'], author['authorId']})
+        # results are in the same order as the ids, null for papers that weren't found
+        for reference in response.json():
+            if reference is None:
+                continue
+            for author in reference['authors']:
+               reference_info[paper]["authors"].append({author['name'], author['authorId']})
 
 def main():  
     
@@ -57,7 +57,6 @@ def main():
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             print(f"An error occurred while fetching references for {paper}: {e}") 
-        time.sleep(1)
         update_references(response, paper)
     print(reference_info)
     
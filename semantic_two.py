@@ -1,5 +1,5 @@
 import requests
-from requests_ratelimiter import LimiterSession
+from rate_limit import RateLimitedSession
 import sys
 import os
 from dotenv import load_dotenv, dotenv_values
@@ -15,10 +15,7 @@ papers = ["Campus-based genomic surveillance uncovers early emergence of a futur
 # {'paper title' : {authors: [{'author name', 'author id'}]}}
 reference_info = {}
 header = {"x-api-key": os.getenv('SEMANTIC_SCHOLAR_API_KEY')}
-session_semantic = LimiterSession(
-        per_minute=30,
-        burst=1
-    )
+session_semantic = RateLimitedSession()
 
 def main():
     for paper in papers[0:1]:
@@ -0,0 +1,104 @@
+"""
+
+Vectorized TF-IDF similarity between preprints and their references.
+Reference texts of a whole batch of preprints go into one sparse TF-IDF matrix (stems and
+pairs of consecutive stems, see relevance.analyze), and every preprint's concepts/methods are
+scored against all of them with a single sparse matrix product, giving a cosine similarity
+between 0 and 1 per reference instead of a yes/no match.
+"""
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+import relevance
+
+# Cosine similarity a reference needs to count as relevant
+MIN_SCORE = 0.1
+
+
+def features(text):
+    stems = [term for position, term in relevance.analyze(text)]
+    return stems + [f"{first} {second}" for first, second in zip(stems, stems[1:])]
+
+
+class TfidfModel:
+    def __init__(self, documents):
+        """
+        documents is a list of texts, row i of self.matrix is the unit TF-IDF vector of documents[i].
+        """
+        # feature -> column
+        self.vocabulary = {}
+        counts = self._counts(documents, grow=True)
+        df = np.bincount(counts.indices, minlength=len(self.vocabulary))
+        # Smoothed idf, so a feature in every document still counts a little
+        self.idf = np.log((1 + len(documents)) / (1 + df)) + 1
+        self.matrix = self._weight(counts)
+
+    def _counts(self, texts, grow=False):
+        if grow:
+            # Unseen features get the next free column while the model is built
+            vocabulary = defaultdict()
+            vocabulary.default_factory = vocabulary.__len__
+        indices = []
+        indptr = [0]
+        for text in texts:
+            if grow:
+                indices.extend(map(vocabulary.__getitem__, features(text)))
+            else:
+                indices.extend([self.vocabulary[feature] for feature in features(text) if feature in self.vocabulary])
+            indptr.append(len(indices))
+        if grow:
+            self.vocabulary = dict(vocabulary)
+        counts = sparse.csr_matrix(
+            (np.ones(len(indices)), indices, indptr), shape=(len(texts), len(self.vocabulary))
+        )
+        # Repeated features of a text are summed into term counts
+        counts.sum_duplicates()
+        return counts
+
+    def _weight(self, counts):
+        # Sublinear tf times idf, rows scaled to unit length so a dot product is the cosine similarity
+        weighted = counts.astype(np.float64)
+        weighted.data = 1 + np.log(weighted.data)
+        weighted = weighted @ sparse.diags(self.idf)
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ weighted)
+
+    def transform(self, texts):
+        """
+        Unit TF-IDF vectors of new texts, features the model hasn't seen are dropped.
+        """
+        return self._weight(self._counts(texts))
+
+    def similarity(self, queries):
+        """
+        Cosine similarity of every query against every document, as a (queries x documents) sparse matrix.
+        """
+        return sparse.csr_matrix(self.transform(queries) @ self.matrix.T)
+
+
+def score_batch(batch):
+    """
+    Score the references of many preprints at once.
+    batch is {preprint: (query text, {ref: text})}; returns {preprint: {ref: similarity}}.
+    References shared by several preprints are only vectorized once.
+    """
+    columns = {}
+    documents = []
+    for query, references in batch.values():
+        for ref, text in references.items():
+            if ref not in columns:
+                columns[ref] = len(documents)
+                documents.append(text)
+    keys = list(batch)
+    if not documents:
+        return {key: {} for key in keys}
+    model = TfidfModel(documents)
+    similarities = model.similarity([batch[key][0] for key in keys])
+    scores = {}
+    for row, key in enumerate(keys):
+        row_scores = similarities.getrow(row).toarray().ravel()
+        scores[key] = {ref: float(row_scores[columns[ref]]) for ref in batch[key][1]}
+    return scores
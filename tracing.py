@@ -0,0 +1,134 @@
+"""
+
+Stage-level tracing of the referee pipeline.
+tracer.span() times a block and, while tracing is on, keeps it as a complete event in the Chrome
+trace event format with the record ID and whatever counts the block adds to it. export() writes
+{"traceEvents": [...]} to a JSON file that chrome://tracing, Perfetto (ui.perfetto.dev) or
+speedscope show as a timeline/flame chart, one row per thread.
+profile() optionally runs cProfile around one record and dumps the stats to <directory>/<record id>.prof.
+"""
+import cProfile
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Tracer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        # thread id -> thread name, for the viewer's row labels
+        self.threads = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def current_record(self):
+        """
+        Record ID of the innermost open span on this thread, or None.
+        """
+        return getattr(self._local, "record", None)
+
+    @contextlib.contextmanager
+    def span(self, name, record=None, **args):
+        """
+        Time the block as a span called name and yield its args, so the block can add counts to them.
+        record defaults to the record of the enclosing span on the same thread.
+        """
+        previous = self.current_record()
+        record = previous if record is None else record
+        if record is not None:
+            args["record"] = record
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self._local.record = previous
+            if self.enabled:
+                thread = threading.current_thread()
+                event = {
+                    "name": name,
+                    "cat": "referee",
+                    "ph": "X",
+                    # microseconds since the tracer was created
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread.ident,
+                    "args": args,
+                }
+                with self._lock:
+                    self.events.append(event)
+                    self.threads[thread.ident] = thread.name
+
+    def export(self, path):
+        """
+        Write the spans recorded so far as a Chrome trace JSON file.
+        """
+        with self._lock:
+            events = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.threads.items()
+            ]
+            events += sorted(self.events, key=lambda event: event["ts"])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def report(self):
+        """
+        One line per stage: spans, total and slowest duration, slowest record. Slowest stages first.
+        """
+        stages = {}
+        with self._lock:
+            for event in self.events:
+                totals = stages.setdefault(event["name"], {"count": 0, "total": 0.0, "max": 0.0, "record": None})
+                totals["count"] += 1
+                totals["total"] += event["dur"] / 1e6
+                if event["dur"] / 1e6 >= totals["max"]:
+                    totals["max"] = event["dur"] / 1e6
+                    totals["record"] = event["args"].get("record")
+        lines = [
+            f"{name}: {totals['count']} spans, {totals['total']:.2f}s total, slowest {totals['max']:.2f}s ({totals['record']})"
+            for name, totals in sorted(stages.items(), key=lambda item: item[1]["total"], reverse=True)
+        ]
+        return "\n".join(lines) if lines else "No spans"
+
+
+tracer = Tracer()
+
+
+@contextlib.contextmanager
+def profile(record_id, directory=None):
+    """
+    Run the block under cProfile and dump the stats to <directory>/<record_id>.prof, or just run it
+    if directory is None. Only the calling thread is profiled.
+    """
+    if directory is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+ allows one active profiler at a time, records processed concurrently go unprofiled
+        log.warning("Not profiling record %s: %s", record_id, e)
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, re.sub(r"[^\w.-]", "_", str(record_id)) + ".prof"))